@@ -6,8 +6,8 @@
 	We add arbitrary data to the model by adding a state or event name with a leading ".".
 """
 
-import sys, copy, pprint, re
-import smk_parser, smk_format, smk_utils
+import sys, copy, re, json
+import smk_parser, smk_format, smk_utils, smk_report, smk_profile
 
 def model_keys(mmm):
 	"Return all model keys that are not *special* (with leading dots)."
@@ -16,24 +16,36 @@ def model_items(mmm):
 	"Return all model values that are not *special*."
 	return [(k, mmm[k]) for k in model_keys(mmm)]
 
-def _build_transition_map(mmm, mopt):	# pylint: disable=unused-argument
+def _build_transition_map(mmm, mopt):
 	"""Builds a dict keyed off state names, with each item a dict keyed off event names, holding lists of
 		transitions. This takes no account of inheritance from superstates or initial transitions.
-		The initial value of the model is the raw parsed machine. """
+		The initial value of the model is the raw parsed machine.
+		If option guard_profile is set to a dict of guard: count of times true, then guarded transitions for an event
+		that are all declared disjoint are ordered with the most likely first."""
 	new_model = {}
 	blank_trans_map = {k: [] for k in mmm.event_list} # Can't use fromkeys(..., []), as only shallow copy of the list.
+	guard_profile = getattr(mopt, 'guard_profile', None)
 	for state in mmm.state_map.values():
 		st_name = state.name
 		new_model[st_name] = copy.deepcopy(blank_trans_map)
 		unguarded = []
+		disjoint = {}	# For each event, true if all guarded transitions are declared disjoint.
 		for trans in state.transition:
 			evdef = [trans.guard, [trans.action] if trans.action else [], trans.target] # Turn action into a list.
 			for ev_name in trans.event:
 				# Guarded transitions are added first, unguarded are added later, as they must be evaluated last.
 				if trans.guard:
 					new_model[st_name][ev_name].append(evdef)
+					disjoint[ev_name] = disjoint.get(ev_name, True) and bool(trans.disjoint)
 				else:
 					unguarded.append((ev_name, evdef))
+		if guard_profile:
+			for ev_name in [e for e, is_disjoint in disjoint.items() if is_disjoint]:
+				# Stable sort, so guards with equal counts stay in declaration order.
+				new_model[st_name][ev_name].sort(key=lambda evdef: -guard_profile.get(evdef[0], 0))
+				if mopt.verbosity:
+					print(f"Guard order for {st_name}/{ev_name}: {[e[0] for e in new_model[st_name][ev_name]]}",
+					  file=sys.stderr)
 		for ev_name, evdef in unguarded:
 			new_model[st_name][ev_name].append(evdef)
 
@@ -43,29 +55,25 @@ def _build_transition_map(mmm, mopt):	# pylint: disable=unused-argument
 
 	return new_model
 
-def get_entry_exit_actions(src, dst):
-	"Return list of exit/entry actions for a transition between the src & dst nodes."
-	action_nodes = [] # We store just a list of nodes, and fix up the mess in one go at the end of the function.
-
-	# By convention self transitions run their own entry & exit actions.
+def get_exited_entered_states(src, dst):
+	"Return tuple (list of states exited, list of states entered) in order for a transition between the src & dst nodes."
+	# By convention self transitions exit and enter themselves.
 	if src.name == dst.name:
-		action_nodes.append(dst.exit)
-		action_nodes.append(src.entry)
-	else:
-		src_ss = src.get_superstates()
-		dst_ss = dst.get_superstates()
+		return [src], [dst]
 
-		# Remove parents common to both nodes.
-		while src_ss and dst_ss and src_ss[-1].name == dst_ss[-1].name:
-			src_ss.pop()
-			dst_ss.pop()
+	src_ss = src.get_superstates()
+	dst_ss = dst.get_superstates()
 
-		# Add exit actions, then entry actions.
-		for s_f in src_ss:
-			action_nodes.append(s_f.exit)
-		for s_r in reversed(dst_ss):
-			action_nodes.append(s_r.entry)
+	# Remove parents common to both nodes.
+	while src_ss and dst_ss and src_ss[-1].name == dst_ss[-1].name:
+		src_ss.pop()
+		dst_ss.pop()
+	return src_ss, list(reversed(dst_ss))
 
+def get_entry_exit_actions(src, dst):
+	"Return list of exit/entry actions for a transition between the src & dst nodes."
+	exited, entered = get_exited_entered_states(src, dst)
+	action_nodes = [s.exit for s in exited] + [s.entry for s in entered] # Exit actions, then entry actions.
 	actions = [x.action for x in action_nodes if x] # Get a list of all actions for non-null nodes.
 	return [a for a in actions if a] # Remove all empty actions.
 
@@ -74,7 +82,9 @@ def _handle_event_inheritance(mmm, mopt):	# pylint: disable=too-many-locals,too-
 		if found."""
 	new_model = copy.deepcopy(mmm)
 	state_map = mmm['.machine'].state_map
+	new_model['.transition_stats'] = {}  # Record cost of each transition for reporting.
 	for st_name, transmap in model_items(mmm): # Iterate over all states.
+		new_model['.transition_stats'][st_name] = {}
 		evdefs = []
 		for ev_name in model_keys(transmap):
 			# If we have no transitions, try up the states until we run out of states or find some transitions.
@@ -87,8 +97,10 @@ def _handle_event_inheritance(mmm, mopt):	# pylint: disable=too-many-locals,too-
 
 			# Now we mutate the transitions depending on their target.
 			new_model[st_name][ev_name] = []
+			new_model['.transition_stats'][st_name][ev_name] = []
 			for guard, explicit_actions, target in evdefs:
 				entry_exit_actions, init_actions, state_change_actions = [], [], []
+				exit_count, entry_count = 0, 0
 
 				# Internal transitions in the state or a superstate are left alone, all we do is the action.
 				if not target:
@@ -97,9 +109,12 @@ def _handle_event_inheritance(mmm, mopt):	# pylint: disable=too-many-locals,too-
 				else:
 					# Get entry/exit actions to final target.
 					entry_exit_actions = get_entry_exit_actions(state_map[st_name], state_map[target])
+					exited, entered = get_exited_entered_states(state_map[st_name], state_map[target])
 
 					# If we have an initial transition then follow it to target until no more initial transitions.
 					init_actions, init_target = state_map[target].get_init_actions_state()
+					exit_count = len(exited)
+					entry_count = len(entered) + len(init_target.get_superstates()) - len(state_map[target].get_superstates())
 					target = init_target.name
 
 					# Add macro to change state to target after any initial transitions ONLY if the transition
@@ -107,10 +122,19 @@ def _handle_event_inheritance(mmm, mopt):	# pylint: disable=too-many-locals,too-
 					if target != st_name:
 						state_change_actions = [f"$SMK_CHANGE_STATE({smk_utils.mk_state_name(target)})"]
 
+				new_model['.transition_stats'][st_name][ev_name].append({
+				  'guard': bool(guard),
+				  'actions': len(smk_format.splitcode(explicit_actions)),
+				  'entry_exit': len(smk_format.splitcode(entry_exit_actions)),
+				  'init': len(smk_format.splitcode(init_actions)),
+				  'exits': exit_count,
+				  'entries': entry_count,
+				})
+
 				# Add comments to actions if required.
 				if mopt.comment_actions:
 					if explicit_actions:
-						explicit_actions.insert(0, '/* Explicit actions. */')
+						explicit_actions = ['/* Explicit actions. */'] + explicit_actions # Do not mutate the list shared with the source model.
 					if entry_exit_actions:
 						entry_exit_actions.insert(0, f"/* Entry/exit actions from state {st_name}. */")
 					if init_actions:
@@ -159,18 +183,41 @@ def _remove_empty_transition_lists(mmm, mopt):	# pylint: disable=unused-argument
 				del mmm[st_name][event_name]
 	return mmm
 
-def _remove_untargetted_states(mmm, mopt):
-	"Removes states that are not targetted by transitions. Removes lots of wasted code. "
+def _remove_unreachable_states(mmm, mopt):
+	"""Removes states that cannot be reached from the reset state by following transitions. Since targets have already
+		had initial transitions followed, this also removes superstates that are only ever entered on the way to a
+		substate. Events that are no longer handled by any state are reported & removed from the machine's event list and
+		from the remaining states. Removes lots of wasted code. """
 	if mopt.optimise >= 2:
-		untargetted_states = smk_utils.OrderedSet(model_keys(mmm))
-		for st_name, trans in model_items(mmm):
-			for ev_name, evdefs in model_items(trans):	# pylint: disable=unused-variable
-				for target_state in [e[2] for e in evdefs]:
-					untargetted_states.discard(target_state)
-		for st_name in untargetted_states:
+		# Adjacency index of state to the set of states that it targets.
+		targets = {st_name: {evdef[2] for evdefs in trans.values() for evdef in evdefs if evdef[2]}
+		  for st_name, trans in model_items(mmm)}
+
+		# Walk graph from the reset state.
+		reset_state = mmm['.machine'].get_init_actions_state()[1].name
+		reachable = {reset_state}
+		pending = [reset_state]
+		while pending:
+			for target_state in targets.get(pending.pop(), ()):
+				if target_state not in reachable:
+					reachable.add(target_state)
+					pending.append(target_state)
+
+		removed = {'states': [st_name for st_name in model_keys(mmm) if st_name not in reachable], 'events': [], 'handlers': 0}
+		for st_name in removed['states']:
 			print('Deleting state:', st_name, file=sys.stderr)
+			removed['handlers'] += sum(1 for evdefs in mmm[st_name].values() if evdefs)
 			del mmm[st_name]
-			# del mmm['.machine'].state_map[st_name]
+			mmm['.transition_stats'].pop(st_name, None)
+
+		handled = {ev_name for _, trans in model_items(mmm) for ev_name, evdefs in trans.items() if evdefs}
+		removed['events'] = [ev_name for ev_name in mmm['.machine'].event_list if ev_name not in handled]
+		for ev_name in removed['events']:
+			print('Event not handled by any reachable state:', ev_name, file=sys.stderr)
+			mmm['.machine'].event_list.discard(ev_name)
+			for st_name in model_keys(mmm):
+				mmm[st_name].pop(ev_name, None)
+		mmm['.removed'] = removed
 	return mmm
 
 def _generate_in_state_data(mmm, mopt):	# pylint: disable=unused-argument
@@ -180,31 +227,80 @@ def _generate_in_state_data(mmm, mopt):	# pylint: disable=unused-argument
 		mmm['.in_state'][state.name] = superstates
 	return mmm
 
-def dump_model(mmm):
-	"Dump the model in excruciating detail."
-	print('Model:', file=sys.stderr)
-	for state, trans_coll in model_items(mmm):	# pylint: disable=unused-variable
-		print("{state}:", file=sys.stderr)
-		for ev_name, trans in trans_coll.items():
-			print(f"  {ev_name}:", file=sys.stderr)
-			pprint.pprint(trans, width=120, stream=sys.stderr)
+def _dump_cells(mmm, mopt):
+	"Return dict of handlers keyed by (state, event) for the cells selected by options dump_states & dump_events."
+	states, events = getattr(mopt, 'dump_states', None), getattr(mopt, 'dump_events', None)
+	cells = {}
+	for st_name, transmap in model_items(mmm):
+		if states and st_name not in states:
+			continue
+		for ev_name, handler in model_items(transmap):
+			if not events or ev_name in events:
+				cells[(st_name, ev_name)] = handler
+	return cells
+
+REMOVED = '<removed>'	# Marker for a dumped cell that a phase has removed.
+
+def dump_model(mmm, mopt, phase='', previous=None, stream=sys.stderr):
+	"""Dump the model in excruciating detail, a line per transition, or as JSON lines if option dump_json is set. If
+		previous is given then only cells that differ from it are dumped. Returns the selected cells for use as the
+		previous value for the next call if option dump_diff is set, else None."""
+	cells = _dump_cells(mmm, mopt)
+	dumped = cells
+	if previous is not None:
+		dumped = {k: v for k, v in cells.items() if previous.get(k, REMOVED) != v}
+		dumped.update({k: REMOVED for k in previous if k not in cells})
+
+	if getattr(mopt, 'dump_json', False):
+		for (st_name, ev_name), handler in dumped.items():
+			stream.write(json.dumps({'phase': phase, 'state': st_name, 'event': ev_name, 'handler': handler}) + '\n')
+	else:
+		print(f"Model{' changes' if previous is not None else ''}:", file=stream)
+		current_state = None
+		for (st_name, ev_name), handler in dumped.items():
+			if st_name != current_state:
+				print(f"{st_name}:", file=stream)
+				current_state = st_name
+			if isinstance(handler, str):		# Gotos & removed cells.
+				print(f"  {ev_name}: {handler}", file=stream)
+			else:
+				print(f"  {ev_name}:", file=stream)
+				for trans in handler:
+					print(f"    {trans!r}", file=stream)
+	return cells if getattr(mopt, 'dump_diff', False) else None
+
+# Phases applied in order to refine the model, each takes a model and options and returns a new model.
+PHASES = (
+  _build_transition_map,
+  _handle_event_inheritance,
+  _remove_unreachable_states,       # Removes states that cannot be reached from the reset state.
+  _optimise_transition_sequences,   # Replaces some code with goto's to previous code.
+  _remove_empty_transition_lists,
+  _generate_in_state_data
+)
 
 def build_model(mmm, mopt):
-	"Successively refine model till we can generate code from it."
-	for x in (
-	  _build_transition_map,
-	  _handle_event_inheritance,
-	  _remove_untargetted_states,       # Removes states that are not targetted by transitions.
-	  _optimise_transition_sequences,   # Replaces some code with goto's to previous code.
-	  _remove_empty_transition_lists,
-	  _generate_in_state_data
-	  ):
-		mmm = x(mmm, mopt)
+	"""Successively refine model till we can generate code from it. If option profile is set then each phase is
+		profiled, and if option profile_out is set the results are also written to the file that it names."""
+	profile_fn = getattr(mopt, 'profile_out', None)
+	profiler = smk_profile.Profiler() if getattr(mopt, 'profile', False) or profile_fn else None
+	previous_cells = None	# Cells from the previous phase for dumping only changes.
+	for x in PHASES:
+		if profiler:
+			with profiler.phase(x.__name__):
+				mmm = x(mmm, mopt)
+				profiler.set_model(mmm)
+		else:
+			mmm = x(mmm, mopt)
 		if mopt.verbosity:
 			print(f"Phase: {x.__name__}", file=sys.stderr)
 		if mopt.verbosity >= 2:
-			dump_model(mmm)
+			previous_cells = dump_model(mmm, mopt, x.__name__, previous_cells)
 			print(file=sys.stderr)
+	if profiler:
+		profiler.print_summary()
+		if profile_fn:
+			profiler.write(profile_fn)
 	return mmm
 
 if __name__ == '__main__':
@@ -217,6 +313,7 @@ if __name__ == '__main__':
 #      'global': smk_format.Formatter_C_GlobalContext,
 #      'multi': smk_format.Formatter_C_MultiContext,
 	  'xml': smk_format.Formatter_XML,
+	  'python': smk_format.Formatter_Python,
 	}
 
 	# Parse command line arguments.
@@ -227,11 +324,28 @@ if __name__ == '__main__':
 	parser.add_argument('-O', '--optimise', type=int, default=0, help='optimisation applied to code')
 	parser.add_argument('-c', '--comment-actions', dest='comment_actions', action='store_true',
 	  help='add comments to computed action code')
+	parser.add_argument('-b', '--batch', action='store_true',
+	  help='also emit a function to process a batch of events, static formatters only')
+	parser.add_argument('-p', '--profile', action='store_true', help='profile model building phases')
+	parser.add_argument('--profile-out', dest='profile_out',
+	  help='profile and write a cProfile file if extension is .prof, else a Chrome trace JSON file')
+	parser.add_argument('-g', '--guard-profile', dest='guard_profile_file',
+	  help='JSON file of guard: count of times true, used to order disjoint guarded transitions')
+	parser.add_argument('-e', '--event-ids', dest='event_id_files', action='append', default=[],
+	  help='C file with global event IDs like `EV_FOO = 3,\', remaps events to a dense index, may be repeated')
+	parser.add_argument('-r', '--report', help='write a report of per state/event costs, CSV if extension is .csv, else JSON')
 
 	parser.add_argument('-v', '--verbose', dest='verbosity', default=0, action='store_const', const=1,
 	  help='Produce some more verbose output')
 	parser.add_argument('-d', '--debug', dest='verbosity', action='store_const', const=2,
 	  help='Produce extremely detailed output for debugging only')
+	parser.add_argument('--dump-state', dest='dump_states', action='append', default=[],
+	  help='with -d only dump this state, may be repeated')
+	parser.add_argument('--dump-event', dest='dump_events', action='append', default=[],
+	  help='with -d only dump this event, may be repeated')
+	parser.add_argument('--dump-json', dest='dump_json', action='store_true', help='with -d dump model as JSON lines')
+	parser.add_argument('--dump-diff', dest='dump_diff', action='store_true',
+	  help='with -d only dump cells changed by each phase')
 	parser.add_argument('-D', '--define', dest='macros', action='append', default=[], help='Define a symbol value.')
 
 	options = parser.parse_args()
@@ -251,8 +365,19 @@ if __name__ == '__main__':
 			sys.exit(f"{options.infile}:{exc.lineno}: error: {exc.msg}")
 
 		if options.verbosity >= 2:
-			print("Options from model: ", tuple(machine.options.content) if machine.options else '<none>', file=sys.stderr)
+			print("Options from model: ", tuple(machine.options.content) if getattr(machine, 'options', None) else '<none>', file=sys.stderr)
 		#print machine.state[0]
+
+		# Read global event IDs if required.
+		options.event_ids = {}
+		for event_id_file in options.event_id_files:
+			try:
+				with open(event_id_file, 'rt', encoding="utf-8") as fd_ids:
+					for m in re.finditer(r'\b(\w+)\s*=\s*(0x[0-9a-f]+|\d+)\s*,', fd_ids.read(), re.I):
+						options.event_ids[m.group(1)] = int(m.group(2), 0)
+			except EnvironmentError as exc:
+				sys.exit(f"{event_id_file}: error: failed to read event IDs: {exc}")
+
 		# Choose an output format.
 		formatter = FORMATTERS[options.format](options.outfile, options)
 
@@ -268,6 +393,18 @@ if __name__ == '__main__':
 				print(f' {macro} = {exp}', file=sys.stderr)
 			print(file=sys.stderr)
 
+		# Read guard profile if required.
+		options.guard_profile = None
+		if options.guard_profile_file:
+			try:
+				with open(options.guard_profile_file, 'rt', encoding="utf-8") as fd_profile:
+					options.guard_profile = json.load(fd_profile)
+			except (EnvironmentError, ValueError) as exc:
+				sys.exit(f"{options.guard_profile_file}: error: failed to read guard profile: {exc}")
+			if not isinstance(options.guard_profile, dict) or \
+			  not all(isinstance(x, int) for x in options.guard_profile.values()):
+				sys.exit(f"{options.guard_profile_file}: error: guard profile must be an object mapping guard to count")
+
 		# Build model.
 		model = build_model(machine, options)
 
@@ -279,5 +416,11 @@ if __name__ == '__main__':
 			raise
 		else:
 			formatter.close()
+
+		# Write report if required.
+		if options.report:
+			smk_report.write_report(smk_report.build_report(model), options.report)
+			if options.verbosity:
+				print(f"Wrote report `{options.report}'.", file=sys.stderr)
 	except smk_parser.NodeError as exc:
-		sys.exit("{options.infile}:0 error: {str(exc)}")
+		sys.exit(f"{options.infile}:0 error: {str(exc)}")
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+"""Benchmark for the smk compile pipeline. Synthetic machines are generated with a given number of states, nesting depth,
+	events per state and guard density, then each phase of build_model() and the C formatter are timed separately. Peak
+	memory is recorded in a separate run as tracemalloc slows things down a lot. Results may be saved as a baseline and
+	later runs compared against it to catch scaling regressions.
+"""
+
+import sys, io, time, json, random, argparse, tracemalloc, contextlib
+from xml.sax.saxutils import quoteattr
+import smk, smk_parser, smk_format
+
+# Default set of cases as (states, depth, events per state, guard density).
+DEFAULT_CASES = ((20, 3, 4, 0.3), (100, 4, 8, 0.3), (400, 5, 8, 0.3))
+
+def generate_machine_xml(n_states, depth, events_per_state, guard_density, seed=0):	# pylint: disable=too-many-locals
+	"""Return the XML for a synthetic machine. States are added one at a time to a random parent no deeper than depth,
+		each has entry & exit actions and events_per_state transitions to random targets, a fraction guard_density of
+		them guarded."""
+	rng = random.Random(seed)
+	n_events = max(2 * events_per_state, 1)
+	children = {None: []}	# Map of state index to list of child state indices, None is the machine.
+	levels = {None: 0}
+	for st_idx in range(n_states):
+		parent = rng.choice([p for p in children if levels[p] < depth])
+		children[parent].append(st_idx)
+		children[st_idx] = []
+		levels[st_idx] = levels[parent] + 1
+
+	def emit_state(st_idx, out):
+		out.append(f"<state name='S{st_idx}'>")
+		if children[st_idx]:
+			out.append(f"<init target='S{children[st_idx][0]}'/>")
+		out.append(f"<entry>entry_{st_idx}();</entry>")
+		out.append(f"<exit>exit_{st_idx}();</exit>")
+		for ev_idx in rng.sample(range(n_events), min(events_per_state, n_events)):
+			guard = f" guard={quoteattr(f'guard_{st_idx}_{ev_idx}(ev)')}" if rng.random() < guard_density else ''
+			target = f" target='S{rng.randrange(n_states)}'" if rng.random() < 0.8 else ''
+			out.append(f"<transition event='EV_{ev_idx}'{guard}{target}>action_{st_idx}_{ev_idx}();</transition>")
+		for child in children[st_idx]:
+			emit_state(child, out)
+		out.append('</state>')
+
+	out = ["<machine name='bench'>"]
+	if children[None]:
+		out.append(f"<init target='S{children[None][0]}'/>")
+	for st_idx in children[None]:
+		emit_state(st_idx, out)
+	out.append('</machine>')
+	return '\n'.join(out)
+
+def run_pipeline(xml_data, mopt, timings=None):
+	"Parse, build & generate a machine, optionally recording the time for each step in dict timings."
+	def timed(name, func, *args):
+		t_start = time.perf_counter()
+		result = func(*args)
+		if timings is not None:
+			timings[name] = timings.get(name, 0.0) + time.perf_counter() - t_start
+		return result
+
+	with contextlib.redirect_stderr(io.StringIO()):	# Phases may chatter on stderr.
+		model = timed('parse', smk_parser.parse, xml_data)
+		for phase in smk.PHASES:
+			model = timed(phase.__name__, phase, model, mopt)
+		formatter = smk_format.Formatter_C_StaticContext('bench.cpp', mopt)
+		timed('generate', formatter.generate, model)
+
+def bench_case(case, mopt, repeat):
+	"Run a single case, return dict of best timings for each step, total time & peak memory."
+	xml_data = generate_machine_xml(*case)
+	best = {}
+	for _ in range(repeat):
+		timings = {}
+		run_pipeline(xml_data, mopt, timings)
+		for name, elapsed in timings.items():
+			best[name] = min(best.get(name, elapsed), elapsed)
+	best['total'] = sum(best.values())
+
+	tracemalloc.start()
+	run_pipeline(xml_data, mopt)
+	peak_mem = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return {'timings': best, 'peak_mem': peak_mem}
+
+def case_name(case):
+	"Make a readable name for a case."
+	return 'states={}/depth={}/events={}/guards={}'.format(*case)	# pylint: disable=consider-using-f-string
+
+def compare(results, baseline, tolerance, min_time=0.0):
+	"""Return a list of regressions, where a timing or peak memory has grown by more than the factor tolerance. A timing
+		must also have grown by more than min_time seconds, so that noise in very short phases is ignored."""
+	regressions = []
+	for name, result in results.items():
+		if name not in baseline:
+			continue
+		prev = baseline[name]
+		checks = [(f'time {k}', v, prev['timings'].get(k), min_time) for k, v in result['timings'].items()]
+		checks.append(('peak_mem', result['peak_mem'], prev.get('peak_mem'), 0))
+		for what, now, then, floor in checks:
+			if then and now > then * tolerance and now - then > floor:
+				regressions.append(f"{name}: {what} {now:.4g} vs baseline {then:.4g} ({now/then:.2f}x)")
+	return regressions
+
+def parse_case(text):
+	"Parse a case from the command line like `100,4,8,0.3'."
+	try:
+		n_states, depth, events, guards = text.split(',')
+		return int(n_states), int(depth), int(events), float(guards)
+	except ValueError as exc:
+		raise argparse.ArgumentTypeError(f"'{text}' expected value like 'states,depth,events,guard_density'") from exc
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the smk compile pipeline with synthetic machines.')
+	parser.add_argument('-c', '--case', type=parse_case, action='append', dest='cases',
+	  help='case to run as states,depth,events_per_state,guard_density, may be repeated')
+	parser.add_argument('-O', '--optimise', type=int, default=2, help='optimisation applied to code')
+	parser.add_argument('-n', '--repeat', type=int, default=3, help='number of runs for each case, best time is used')
+	parser.add_argument('-b', '--baseline', help='baseline JSON file to compare against')
+	parser.add_argument('-s', '--save', help='save results as JSON to this file, for use as a baseline')
+	parser.add_argument('-t', '--tolerance', type=float, default=1.5,
+	  help='factor by which a result may exceed the baseline before it is a regression')
+	parser.add_argument('-m', '--min-time', type=float, default=20.0,
+	  help='time in ms by which a timing must also exceed the baseline before it is a regression')
+	options = parser.parse_args()
+	model_options = argparse.Namespace(optimise=options.optimise, comment_actions=False, verbosity=0, batch=False)
+
+	all_results = {}
+	for bench in options.cases or DEFAULT_CASES:
+		res = bench_case(bench, model_options, options.repeat)
+		all_results[case_name(bench)] = res
+		print(f"{case_name(bench)}: total {res['timings']['total']*1000:.1f}ms, peak memory {res['peak_mem']/1024:.0f}KiB")
+		for step, step_time in res['timings'].items():
+			if step != 'total':
+				print(f"  {step:32} {step_time*1000:10.2f}ms")
+
+	if options.save:
+		with open(options.save, 'wt', encoding='utf-8') as fout:
+			json.dump(all_results, fout, indent=1)
+	if options.baseline:
+		with open(options.baseline, 'rt', encoding='utf-8') as fin:
+			found = compare(all_results, json.load(fin), options.tolerance, options.min_time / 1000)
+		for regression in found:
+			print('Regression:', regression, file=sys.stderr)
+		if found:
+			sys.exit(1)
@@ -1,7 +1,7 @@
 """Output formatting classes for smk."""
 
 import sys, re, os, io, copy, textwrap, pprint
-import smk_utils
+import smk_utils, smk_parser
 
 # This warning flagged for Formatter subclasses that inherit member attributes.
 # pylint: disable=no-member
@@ -84,7 +84,8 @@ class OutputFormatter:
 			sys.stdout.write(msg + '\n')
 
 	def _preprocess(self, text):
-		pass
+		"Hook for subclasses to rewrite text before it is written."
+		return text
 
 	def write(self, text, stream=0):
 		"Write data to specified stream."
@@ -160,6 +161,10 @@ class Formatter_C(OutputFormatter):		# pylint: disable=invalid-name
 		  '''Macro that takes a single parameter that is the integer state ID, called whenever the state machine
 				changes state. Typically used for logging.'''
 		),
+		'EVENT_INDEX_PREFIX': (
+		  'EVI_$(MACHINE_NAME_UC)_',
+		  '''Macro used to form local event index names when events are remapped to a dense range.'''
+		),
 	}
 	EXTRA_SYMBOL_DEFINITIONS = {}
 	DEFAULT_FILENAMES = ('output.h', 'output.cpp')
@@ -179,11 +184,13 @@ class Formatter_C(OutputFormatter):		# pylint: disable=invalid-name
 		"Make a canonical event name."
 		return ev_name.upper()
 
-	RE_PREPROCESS = re.compile(r'\$SMK_CHANGE_STATE\((\w+)\)')
+	# The LOCAL variant writes the state to a local variable `state_' rather than the context, used by the batch function.
+	RE_PREPROCESS = re.compile(r'\$SMK_CHANGE_(LOCAL_)?STATE\((\w+)\)')
 	def _preprocess(self, text):
-		repl = '; '.join([x for x in (self.symbols['CHANGE_STATE_HOOK'], 'PROP(state_) = st_') if x and not x.isspace()])
 		def subber(m):
-			return repl.replace('st_', m.group(1))
+			state_lvalue = 'state_' if m.group(1) else 'PROP(state_)'
+			repl = '; '.join([x for x in (self.symbols['CHANGE_STATE_HOOK'], f'{state_lvalue} = st_') if x and not x.isspace()])
+			return repl.replace('st_', m.group(2))
 		return self.RE_PREPROCESS.sub(subber, text)
 
 	def _generate_is_in_state_data(self, model):
@@ -203,6 +210,35 @@ class Formatter_C(OutputFormatter):		# pylint: disable=invalid-name
 		self.symbols['IS_IN_DATA'] = pretty_fill(', '.join([f'0x{x:02x}' for x in is_in_data]))
 		self.symbols['IS_IN_DATA_DIM'] = str(STRIDE)
 
+	def _generate_event_map(self, model):
+		"""If option event_ids is set to a dict of global event IDs, generate a PROGMEM table mapping global event ID to a
+			dense local index starting from 1 for the events used by this machine, so that the event switch can compile
+			to a jump table. Unused events map to zero. Returns a dict of event name to local index name, or None."""
+		event_ids = getattr(self.options, 'event_ids', None)
+		if not event_ids:
+			self.symbols['EVENT_SWITCH'] = '$(EVENT_ACCESSOR)'
+			return None
+
+		index_names = {}
+		for st_name, evdict in model.items():
+			if not st_name.startswith('.'):
+				for ev_name in evdict:
+					index_names.setdefault(ev_name, f'$(EVENT_INDEX_PREFIX){self.mk_event_name(ev_name)}')
+		if len(index_names) > 255:
+			raise smk_parser.NodeError(f"too many events ({len(index_names)}) to remap to a uint8_t index")
+		missing = [ev_name for ev_name in index_names if self.mk_event_name(ev_name) not in event_ids]
+		if missing:
+			raise smk_parser.NodeError(f"no global ID found for events {', '.join(missing)}")
+
+		event_map = [0] * (max((event_ids[self.mk_event_name(e)] for e in index_names), default=0) + 1)
+		for local_idx, ev_name in enumerate(index_names, 1):
+			event_map[event_ids[self.mk_event_name(ev_name)]] = local_idx
+
+		self.symbols['EVENT_INDEX_DECL'] = ',\n'.join([f'{x} = {i}' for i, x in enumerate(index_names.values(), 1)])
+		self.symbols['EVENT_MAP_DATA'] = pretty_fill(', '.join([str(x) for x in event_map]))
+		self.symbols['EVENT_SWITCH'] = 'smk_event_index_$(MACHINE_NAME)($(EVENT_ACCESSOR))'
+		return index_names
+
 	def generate(self, model):	# pylint: disable=too-many-branches,too-many-statements,too-many-locals
 		"Generate output."
 
@@ -234,6 +270,7 @@ class Formatter_C(OutputFormatter):		# pylint: disable=invalid-name
 		self.symbols['INITIAL_STATE'] = smk_utils.mk_state_name(reset_state.name)
 
 		self._generate_is_in_state_data(model)
+		event_index_names = self._generate_event_map(model)
 
 		# Write main nested switch statement body.
 		handler = []
@@ -242,10 +279,10 @@ class Formatter_C(OutputFormatter):		# pylint: disable=invalid-name
 			if st_name.startswith('.'):
 				continue
 			handler.append(f'case {smk_utils.mk_state_name(st_name)}:')
-			handler.append('    switch($(EVENT_ACCESSOR)) {')
+			handler.append('    switch($(EVENT_SWITCH)) {')
 
 			for ev_name, event_defs in evdict.items():
-				handler.append(f'    case {self.mk_event_name(ev_name)}:')
+				handler.append(f'    case {event_index_names[ev_name] if event_index_names else self.mk_event_name(ev_name)}:')
 
 				# Check if the only action for this handler is a goto,
 				if isinstance(event_defs, str):
@@ -283,6 +320,8 @@ class Formatter_C(OutputFormatter):		# pylint: disable=invalid-name
 			handler.append('}')
 			handler.append('break;')
 		self.symbols['HANDLER_BODY'] = '\n'.join(handler)
+		# Same again but changing a state variable held locally, only used if the template references it.
+		self.symbols['BATCH_HANDLER_BODY'] = self.symbols['HANDLER_BODY'].replace('$SMK_CHANGE_STATE(', '$SMK_CHANGE_LOCAL_STATE(')
 
 		self.write(self.HEADER_TEMPLATE, stream=self.HEADER)
 		self.write(self.SOURCE_TEMPLATE, stream=self.SOURCE)
@@ -345,9 +384,63 @@ void smk_process_$(MACHINE_NAME)($(EVENT_REFERENCE_TYPE) ev) {
 }
 
 /* EOF */
+"""
+	# Optional batch dispatch function, added to the templates if the `batch' option is set.
+	BATCH_HEADER_TEMPLATE = """\
+/* Pass a batch of events to the machine. The state is held in a local variable for the duration of the batch and
+   written back to the context once at the end, so while the batch runs the context state and
+   smk_is_in_$(MACHINE_NAME)() are stale. Actions must not rely on them, or call smk_process_$(MACHINE_NAME)(). */
+void smk_process_batch_$(MACHINE_NAME)(const $(EVENT_REFERENCE_TYPE)* evs, size_t n);
+
+"""
+	BATCH_SOURCE_TEMPLATE = """\
+void smk_process_batch_$(MACHINE_NAME)(const $(EVENT_REFERENCE_TYPE)* evs, size_t n) {
+    $(STATE_TYPE) state_ = context.state_;
+
+    while (n--) {
+        $(EVENT_REFERENCE_TYPE) ev = *evs++;
+        if ($(RESET_EVENT_NAME) == $(EVENT_ACCESSOR)) {
+            $SMK_CHANGE_LOCAL_STATE($(INITIAL_STATE));
+            $(RESET_FUNCTION_BODY)
+            continue;
+        }
+
+        switch(state_) {
+        default:
+            break;
+
+        $(BATCH_HANDLER_BODY)
+        }
+    }
+    context.state_ = state_;
+}
+
+"""
+	# Optional event remapping table, inserted after the verbatim code if the `event_ids' option is set.
+	EVENT_MAP_SOURCE_TEMPLATE = """\
+/* Dense local event indices. */
+enum {
+    $(EVENT_INDEX_DECL)
+};
+
+/* Map global event ID to local event index, events not handled by the machine map to zero. */
+static const uint8_t smk_event_map_$(MACHINE_NAME)[] PROGMEM = {
+    $(EVENT_MAP_DATA)
+};
+
+static inline uint8_t smk_event_index_$(MACHINE_NAME)(unsigned id) {
+    return (id < sizeof(smk_event_map_$(MACHINE_NAME))) ? pgm_read_byte(&smk_event_map_$(MACHINE_NAME)[id]) : 0;
+}
+
 """
 	def __init__(self, path, options):
 		Formatter_C.__init__(self, path, options)
+		if getattr(options, 'event_ids', None):
+			self.SOURCE_TEMPLATE = self.SOURCE_TEMPLATE.replace('$(VERBATIM_CODE)\n\n',	# pylint: disable=invalid-name
+			  '$(VERBATIM_CODE)\n\n' + self.EVENT_MAP_SOURCE_TEMPLATE, 1)
+		if getattr(options, 'batch', False):
+			self.HEADER_TEMPLATE = self.insert_lines(self.HEADER_TEMPLATE, self.BATCH_HEADER_TEMPLATE)	# pylint: disable=invalid-name
+			self.SOURCE_TEMPLATE = self.insert_lines(self.SOURCE_TEMPLATE, self.BATCH_SOURCE_TEMPLATE)
 
 
 class Formatter_C_StaticContextIsIn(Formatter_C_StaticContext): 	# pylint: disable=invalid-name
@@ -366,3 +459,109 @@ bool smk_is_in_$(MACHINE_NAME)($(STATE_TYPE) state) {
 }
 
 """)
+
+
+class Formatter_Python(OutputFormatter): 	# pylint: disable=invalid-name
+	"""Emit an executable Python module that simulates the machine on a host. Guards are evaluated by a user supplied hook
+		since they are "C" expressions, likewise actions are only passed to an optional hook. Used for fast regression
+		testing by replaying event traces without a cross-compiler."""
+	SYMBOL_DEFINITIONS = {
+		'RESET_EVENT_NAME': (
+		  'EV_SM_RESET',
+		  '''Name of the reset event that resets the machine to it's intial state.'''
+		),
+	}
+	DEFAULT_FILENAMES = ('output.py',)
+	STREAMS = ('DEFAULT',)
+
+	TEMPLATE = """\
+# This file is auto-generated. Do not edit.
+
+\"\"\"Host simulator for state machine `$(MACHINE_NAME)'.\"\"\"
+
+MACHINE_NAME = '$(MACHINE_NAME)'
+RESET_EVENT = '$(RESET_EVENT_NAME)'
+INITIAL_STATE = '$(INITIAL_STATE)'
+RESET_ACTIONS = $(RESET_ACTIONS)
+
+# Transition table keyed by state then event, each a tuple of (guard or None, actions, new state or None).
+TRANSITIONS = $(TRANSITIONS)
+
+class Machine:
+    \"\"\"Simulate the machine. Hook guard(guard, ev, state) returns the value of a guard expression, by default all guards are
+        true. Hook action(action, ev, state) is called for each action. Hook event_id(ev) returns the event name, by default
+        the event is the name. Each transition is recorded in the trace as a tuple (event, old state, new state).
+        The count of times each guard was true is kept in guard_counts, which may be saved as JSON for use as a guard
+        profile to smk.\"\"\"
+    def __init__(self, guard=None, action=None, event_id=None):
+        self.guard = guard or (lambda guard, ev, state: True)
+        self.action = action
+        self.event_id = event_id or (lambda ev: ev)
+        self.state = None
+        self.trace = []
+        self.guard_counts = {}
+
+    def _do_actions(self, actions, ev):
+        if self.action:
+            for action in actions:
+                self.action(action, ev, self.state)
+
+    def process(self, ev):
+        "Pass an event to the machine, return the new state."
+        ev_id = self.event_id(ev)
+        if ev_id == RESET_EVENT:
+            self._do_actions(RESET_ACTIONS, ev)
+            self.trace.append((ev_id, self.state, INITIAL_STATE))
+            self.state = INITIAL_STATE
+            return self.state
+
+        for guard, actions, target in TRANSITIONS.get(self.state, {}).get(ev_id, ()):
+            if guard is None or self.guard(guard, ev, self.state):
+                if guard is not None:
+                    self.guard_counts[guard] = self.guard_counts.get(guard, 0) + 1
+                self._do_actions(actions, ev)
+                if target is not None:
+                    self.trace.append((ev_id, self.state, target))
+                    self.state = target
+                break
+        return self.state
+
+    def run(self, evs):
+        "Process a sequence of events, return the trace."
+        for ev in evs:
+            self.process(ev)
+        return self.trace
+"""
+
+	RE_IGNORED_ACTION = re.compile(r'\$SMK_CHANGE_STATE\(|/\*.*\*/$')
+	@classmethod
+	def _sim_actions(cls, actions):
+		"Return a tuple of action statements with state change macros & comments removed."
+		return tuple(x for x in splitcode(actions) if not cls.RE_IGNORED_ACTION.match(x))
+
+	def generate(self, model):
+		"Generate output."
+		machine = model['.machine']
+		self.symbols['MACHINE_NAME'] = machine.name
+		reset_actions, reset_state = machine.get_init_actions_state()
+		self.symbols['RESET_ACTIONS'] = repr(self._sim_actions(reset_actions))
+		self.symbols['INITIAL_STATE'] = reset_state.name
+
+		# Gotos are replaced by the handler that they jump to.
+		labelled = {}
+		for st_name, labels in model.get('.goto_labels', {}).items():
+			for ev_name, label in labels.items():
+				labelled[label.strip().rstrip(':')] = model[st_name][ev_name]
+
+		transitions = {}
+		for st_name, evdict in model.items():
+			if st_name.startswith('.'):
+				continue
+			transitions[st_name] = {}
+			for ev_name, event_defs in evdict.items():
+				if isinstance(event_defs, str):
+					event_defs = labelled[re.match(r'goto (\w+);', event_defs).group(1)]
+				transitions[st_name][ev_name] = tuple(
+				  (guard or None, self._sim_actions(actions), target or None) for guard, actions, target in event_defs)
+		self.symbols['TRANSITIONS'] = pprint.pformat(transitions, width=COLUMNS, sort_dicts=False)
+		self.write(self.TEMPLATE)
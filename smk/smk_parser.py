@@ -273,6 +273,12 @@ def validate_name(name):
 	if not re.match(r'(?i)[a-z_][a-z0-9_]*$', name):
 		raise ValueError(f"name `{name}' illegal") # ** Tested
 	return name
+def validate_flag(text):
+	"Is the input a boolean flag? Returns `yes' or an empty string, as attributes are always strings."
+	flag = text.strip().lower()
+	if flag not in ('', 'yes', 'no', 'true', 'false', '1', '0'):
+		raise ValueError(f"flag `{text}' illegal")
+	return 'yes' if flag in ('yes', 'true', '1') else ''
 def validate_names(names):
 	"Is the set of words all valid names?"
 	namelist = names.split()
@@ -302,6 +308,7 @@ class Transition(Node):
 	  'event': (Node.OPT_MANDATORY, validate_names),
 	  'target': (Node.OPT_OPTIONAL, lambda n: n.strip()),
 	  'guard': (Node.OPT_OPTIONAL, lambda n: n.strip()),
+	  'disjoint': (Node.OPT_OPTIONAL, validate_flag), # Guard is exclusive of other guards so may be reordered.
 	}
 	def validate(self):
 		for event_name in self.event:
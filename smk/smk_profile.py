@@ -0,0 +1,88 @@
+"""Profiling for the phases of smk.build_model(). Records wall time, memory blocks allocated by the phase & still live at
+	its end, peak memory & model size for each phase, and can write a cProfile `.prof' file or a Chrome trace JSON file
+	for viewing in chrome://tracing or Perfetto. Tracing or profiling that is already active is left alone, and the
+	corresponding data is not recorded.
+"""
+
+import sys, time, json, cProfile, tracemalloc, contextlib
+
+def model_stats(mmm):
+	"Return a dict of statistics on the size of a model."
+	stats = {'states': 0, 'cells': 0, 'handlers': 0, 'gotos': 0, 'transitions': 0}
+	for st_name, transmap in mmm.items():
+		if st_name.startswith('.'):
+			continue
+		stats['states'] += 1
+		for ev_name, handler in transmap.items():
+			if ev_name.startswith('.') or not handler:
+				continue
+			stats['cells'] += 1
+			if isinstance(handler, str):
+				stats['gotos'] += 1
+			else:
+				stats['handlers'] += 1
+				stats['transitions'] += len(handler)
+	stats['labels'] = sum(len(x) for x in mmm.get('.goto_labels', {}).values())
+	return stats
+
+class Profiler:
+	"""Collects a record for each phase. Output is written by calling write() with a filename, the extension `.prof'
+		gives cProfile output, anything else a Chrome trace."""
+	def __init__(self):
+		self.records = []
+		self.cprofile = cProfile.Profile()
+		self.t_origin = time.perf_counter()
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		"Context manager to profile a phase, the model returned by the phase should be passed to set_model()."
+		record = {'name': name, 'live_blocks': None, 'peak_mem': None}
+		self._model = None		# pylint: disable=attribute-defined-outside-init
+		tracing = not tracemalloc.is_tracing()		# Do not disturb an outer tracemalloc session.
+		if tracing:
+			tracemalloc.start()
+		try:
+			self.cprofile.enable()
+			profiling = True
+		except ValueError:		# Another profiler is already active.
+			profiling = False
+		t_start = time.perf_counter()
+		try:
+			yield self
+		finally:
+			if profiling:
+				self.cprofile.disable()
+			record['start'] = t_start - self.t_origin
+			record['duration'] = time.perf_counter() - t_start
+			if tracing:
+				record['live_blocks'] = len(tracemalloc.take_snapshot().traces)	# Only blocks allocated since start are traced.
+				record['peak_mem'] = tracemalloc.get_traced_memory()[1]
+				tracemalloc.stop()
+			record['stats'] = model_stats(self._model) if self._model is not None else {}
+			self.records.append(record)
+
+	def set_model(self, mmm):
+		"Record the model from the current phase for gathering statistics."
+		self._model = mmm		# pylint: disable=attribute-defined-outside-init
+
+	def print_summary(self, stream=sys.stderr):
+		"Print a table of phase records."
+		print(f"{'Phase':32} {'Time/ms':>10} {'Live blks':>10} {'Peak/KiB':>10}  Model", file=stream)
+		for rec in self.records:
+			stats = ' '.join(f'{k}={v}' for k, v in rec['stats'].items())
+			blocks = '-' if rec['live_blocks'] is None else rec['live_blocks']
+			peak = '-' if rec['peak_mem'] is None else f"{rec['peak_mem']/1024:.0f}"
+			print(f"{rec['name']:32} {rec['duration']*1000:10.2f} {blocks:>10} {peak:>10}  {stats}", file=stream)
+
+	def write(self, filename):
+		"Write profile data to a file."
+		if filename.endswith('.prof'):
+			self.cprofile.dump_stats(filename)
+			return
+		events = [{
+		  'name': rec['name'], 'ph': 'X', 'pid': 0, 'tid': 0,
+		  'ts': rec['start'] * 1e6, 'dur': rec['duration'] * 1e6,		# Chrome trace times are in microseconds.
+		  'args': dict(rec['stats'], **{k: rec[k] for k in ('live_blocks', 'peak_mem') if rec[k] is not None}),
+		} for rec in self.records]
+		with open(filename, 'wt', encoding='utf-8') as fout:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fout, indent=1)
@@ -0,0 +1,78 @@
+"""Static cost report for an elaborated smk model. For each state & event cell we list the worst case work done by the
+	generated code, so that timing regressions from model changes can be spotted before they reach hardware.
+"""
+
+import re, csv, json
+
+# Column names for each cell in the report, in order.
+CELL_FIELDS = ('state', 'event', 'transitions', 'guards', 'actions', 'entry_exit', 'init', 'exits', 'entries', 'goto')
+
+RE_LABEL = re.compile(r'T\d+')
+
+def _cell_cost(stats):
+	"""Return a dict of worst case costs for a cell from the list of per transition stats. The guards are all evaluated
+		if none are true, the other values are the maximum over all transitions, each taken independently."""
+	return {
+	  'transitions': len(stats),
+	  'guards': sum(1 for x in stats if x['guard']),
+	  'actions': max((x['actions'] for x in stats), default=0),
+	  'entry_exit': max((x['entry_exit'] for x in stats), default=0),
+	  'init': max((x['init'] for x in stats), default=0),
+	  'exits': max((x['exits'] for x in stats), default=0),
+	  'entries': max((x['entries'] for x in stats), default=0),
+	}
+
+def build_report(mmm):
+	"Build a report as a dict from a fully elaborated model."
+	cells = []
+	shared = {}		# Goto labels, keyed by label, value a dict of the target cell and the cells that jump to it.
+	for st_name, labels in mmm.get('.goto_labels', {}).items():
+		for ev_name, label in labels.items():
+			shared[RE_LABEL.search(label).group()] = {'state': st_name, 'event': ev_name, 'users': []}
+
+	for st_name in [k for k in mmm if not k.startswith('.')]:
+		for ev_name, handler in mmm[st_name].items():
+			cell = {'state': st_name, 'event': ev_name}
+			cell.update(_cell_cost(mmm['.transition_stats'][st_name][ev_name]))
+			cell['goto'] = ''
+			if isinstance(handler, str):	# Handler has been replaced by a goto to a previous handler.
+				cell['goto'] = RE_LABEL.search(handler).group()
+				shared[cell['goto']]['users'].append({'state': st_name, 'event': ev_name})
+			cells.append(cell)
+
+	machine = mmm['.machine']
+	sizes = {
+	  'states': len(machine.state_map),
+	  'states_emitted': len(set(c['state'] for c in cells)),
+	  'events': len(list(machine.event_list)),
+	  'cells': len(cells),
+	  'handlers': sum(1 for c in cells if not c['goto']),
+	  'gotos': sum(1 for c in cells if c['goto']),
+	  'labels': len(shared),
+	  'actions': sum(c['actions'] + c['entry_exit'] + c['init'] for c in cells if not c['goto']),
+	}
+	worst = {k: max((c[k] for c in cells), default=0) for k in CELL_FIELDS[2:-1]}
+	removed = mmm.get('.removed', {'states': [], 'events': [], 'handlers': 0})
+	return {
+	  'machine': machine.name, 'sizes': sizes, 'worst': worst, 'removed': removed, 'shared_handlers': shared, 'cells': cells
+	}
+
+def write_report(report, filename):
+	"""Write the report to a file, as CSV if the filename has a `.csv' extension, else JSON. The CSV format has summary
+		data in leading lines with a `#' in the first column, which are treated as comments by csv_parser."""
+	with open(filename, 'wt', encoding='utf-8', newline='') as fout:
+		if filename.lower().endswith('.csv'):
+			writer = csv.writer(fout)
+			writer.writerow(['# machine', report['machine']])
+			for key, value in report['sizes'].items():
+				writer.writerow([f'# size {key}', value])
+			for key, value in report['worst'].items():
+				writer.writerow([f'# worst {key}', value])
+			for key, value in report['removed'].items():
+				writer.writerow([f'# removed {key}', ' '.join(value) if isinstance(value, list) else value])
+			writer.writerow(CELL_FIELDS)
+			for cell in report['cells']:
+				writer.writerow([cell[k] for k in CELL_FIELDS])
+		else:
+			json.dump(report, fout, indent=1)
+			fout.write('\n')
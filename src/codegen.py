@@ -3,7 +3,7 @@
 """A helper for writing code generators.
 """
 
-import sys, os, re
+import sys, os, re, time, json, codecs, hashlib, tempfile, contextlib, collections
 
 class Verbosity:
 	""" Class to manage verbosity levels.
@@ -11,9 +11,17 @@ class Verbosity:
 		INFO  -- a line or so telling you that everything is working.
 		ERROR -- no output or an error.
 		QUIET -- no output at all, ever.
+		Messages may also be written as JSON lines records to json_stream, or appended as dicts to the list collector,
+		with a timestamp, level and optional context like file & line. Phase timings are only recorded in these modes,
+		at INFO level.
+		If exit_on_error is false, error() raises CodegenException rather than exiting.
 	"""
 	DEBUG, INFO, ERROR, QUIET = range(4)
+	LEVEL_NAMES = ('debug', 'info', 'error', 'quiet')
 	level = INFO
+	json_stream = None		# Stream for JSON lines records, if None then plain text is printed.
+	collector = None		# List to collect records in process, if None then records are written.
+	exit_on_error = True
 
 	@classmethod
 	def add_argparse_options(cls, parser):
@@ -22,6 +30,7 @@ class Verbosity:
 	  		help='produce some more verbose output, default is a single line on success')
 		parser.add_argument('-q', '--quiet', default=0, action='count',
 	  		help='ued once, only print errors; twice print _nothing_')
+		parser.add_argument('--log-json', action='store_true', help='write messages to stderr as JSON lines with timestamps')
 		return parser
 
 	@classmethod
@@ -35,49 +44,119 @@ class Verbosity:
 			cls.level = cls.QUIET
 		else:
 			cls.level = cls.INFO
+		if getattr(options, 'log_json', False):
+			cls.json_stream = sys.stderr
 
 	@classmethod
-	def message(cls, msg, lvl=None):
-		"Print a message with no newline."
+	def _record(cls, lvl, msg, context):
+		"Make a record and either collect it or write it as a JSON line."
+		record = {'time': time.time(), 'level': cls.LEVEL_NAMES[lvl], 'script': os.path.basename(sys.argv[0]), 'msg': msg.strip()}
+		record.update(context)
+		if cls.collector is not None:
+			cls.collector.append(record)
+		else:
+			print(json.dumps(record), file=cls.json_stream)
+
+	@classmethod
+	def message(cls, msg, lvl=None, **context):
+		"Print a message with no newline, optional keyword args like file & line are added to structured records."
 		if lvl is None:
 			lvl = cls.INFO
-		if lvl >= cls.level:
+		if lvl < cls.level:		# Checked first so that disabled messages cost almost nothing.
+			return
+		if cls.json_stream is None and cls.collector is None:
 			print(msg, end='', file=sys.stderr)
+		else:
+			cls._record(lvl, msg, context)
 
 	@classmethod
-	def error(cls, msg):
-		"Print a message and exit with failure status."
-		cls.message(f"Error: {msg}\n", cls.ERROR)
+	def error(cls, msg, **context):
+		"Print a message and exit with failure status, or raise CodegenException if exit_on_error is false."
+		cls.message(f"Error: {msg}\n", cls.ERROR, **context)
+		if not cls.exit_on_error:
+			raise CodegenException(msg)
 		sys.exit(1)
 
-def message(msg, lvl=None):
+	@classmethod
+	@contextlib.contextmanager
+	def phase(cls, name):
+		"Context manager to time a phase, recorded if structured output is enabled or printed at DEBUG level."
+		t_start = time.perf_counter()
+		try:
+			yield
+		finally:
+			duration = time.perf_counter() - t_start
+			if cls.json_stream is not None or cls.collector is not None:
+				if cls.level <= cls.INFO:
+					cls._record(cls.INFO, f"phase {name}", {'phase': name, 'duration': duration})
+			elif cls.level <= cls.DEBUG:
+				print(f"({name} {duration*1000:.2f}ms) ", end='', file=sys.stderr)
+
+	@classmethod
+	@contextlib.contextmanager
+	def collect(cls):
+		"""Context manager that yields a list that collects message records rather than writing them. Errors raise
+			CodegenException rather than exiting. For use by batch tools & servers calling generators in process."""
+		saved = cls.collector, cls.exit_on_error
+		records = []
+		cls.collector, cls.exit_on_error = records, False
+		try:
+			yield records
+		finally:
+			cls.collector, cls.exit_on_error = saved
+
+def message(msg, lvl=None, **context):
 	"Print a message with no newline."
-	Verbosity.message(msg, lvl)
-def error(msg):
+	Verbosity.message(msg, lvl, **context)
+def error(msg, **context):
 	"Print a message and exit with failure status."
-	Verbosity.error(msg)
+	Verbosity.error(msg, **context)
 
 class CodegenException(Exception):
 	"Exception raised by Codegen and associated classes."
 	pass
 
+class CodegenCacheHit(Exception):
+	"Raised by Codegen.begin() on a cache hit, after the output has been written, if it is not to exit."
+	pass
+
 class Codegen:
 	"""Class for doing much of the grunt work of emitting "C" code. It reads a source file; either using the file object's read method to get a
 		list of lines, or a custom reader function supplying data in any format.
+		If cache_dir is set, from environment variable CODEGEN_CACHE, output is cached keyed by a hash of the script &
+		the local modules that it imports (see script_files()), the arguments, the output filename, and the names &
+		contents of the input & dependency files. On a hit begin() writes the output from the cache and exits, or if
+		Verbosity.exit_on_error is false, as within Verbosity.collect(), raises CodegenCacheHit. Generators whose output
+		depends on anything else, like the time, should pass cache=False. The cache is trimmed to cache_size bytes, from
+		CODEGEN_CACHE_SIZE, by removing the least recently used entries.
+		If depfile is set, from environment variable CODEGEN_DEPFILE, a Makefile style depfile is written to the output
+		filename with `.d' appended, listing the script & local modules, and all input & dependency files. No depfile is
+		written for a file that is updated in place, as it would make the file depend on the script.
 	"""
-	def __init__(self, infile, outfile):
+	cache_dir = os.environ.get('CODEGEN_CACHE') or None
+	cache_size = int(os.environ.get('CODEGEN_CACHE_SIZE', 10_000_000))
+	depfile = bool(os.environ.get('CODEGEN_DEPFILE'))
+
+	def __init__(self, infile, outfile, depends=(), cache=True):
 		"""Initialise with input filename that the code is generated from; this may be a single file or a list.
-			and a single output file.
+			and a single output file. Optional depends lists other files that affect the output for the cache key.
+			If cache is false the output is never cached.
 		"""
 		self.infile, self.outfile = infile, outfile
+		self.depends = list(depends)
+		self.cache = cache
+		self.inputs = []		# Files actually read, for the depfile.
+		self.cache_key = None	# Set by begin() if the output should be written to the cache.
 		self.contents = []	# Output lines.
 		self.trailers = []	# List of lists of lines to be popped before writing.
 		self.indent_cols = 0 	# Start with no indent.
+		self.indent_prefix = ''	# String of indent_cols spaces prepended to each line.
 		self.script = os.path.basename(sys.argv[0])
 
 	def indent(self, cols=4):
 		"Emit an indent as a count of space characters."
 		self.indent_cols += cols
+		self.indent_prefix = ' ' * self.indent_cols
 	def dedent(self, cols=4):
 		"Dedent (or unindent) by the count given."
 		self.indent(-cols)
@@ -86,20 +165,26 @@ class Codegen:
 		"""Read the contents of the input file, either as a single string or using the specified reader function.
 		"""
 		message(f"{self.script}: ")
+		if self.cache_dir and self.cache and self._check_cache():
+			if not Verbosity.exit_on_error:
+				raise CodegenCacheHit(self.outfile)
+			sys.exit()
 		def read_single_file(fn):
-			message(f"reading input file `{fn}'... ")
+			message(f"reading input file `{fn}'... ", file=fn)
 			try:
 				with open(fn, 'rt', encoding="utf-8") as fin_r:
+					self.inputs.append(fn)
 					return fin_r.read() if reader is None else reader(fin_r)
 			except EnvironmentError:
-				error(f"failed to read `{fn}'.")
+				error(f"failed to read `{fn}'.", file=fn)
 
 			# We catch a base Exception as the user reader method could raise any exception type.
 			#except Exception as exc:	# pylint: disable=broad-except
 			#	error(f"exception `{exc}'' during reading `{fn}'.")
 			return None		# Shut up Pylint.
 
-		return read_single_file(self.infile) if isinstance(self.infile, str) else [read_single_file(fn) for fn in self.infile]
+		with Verbosity.phase('read'):
+			return read_single_file(self.infile) if isinstance(self.infile, str) else [read_single_file(fn) for fn in self.infile]
 
 	def add(self, text, eat_nl=False, add_nl=None, trailer='', col_width=0, indent=0): # pylint: disable=too-many-arguments
 		"""Add either a string that will be split into lines, or a list of lines to the contents of the output file. Indentation will be added.
@@ -108,18 +193,27 @@ class Codegen:
 			Optional arg trailer sets string to be appended. Optional arg col_width left justifies all of the line apart from the traier.
 			If indent is positive, it is the equivalent of calling indent() _after_ all output is added. If negative, it is as if denent is called _before_
 			any output is added."""
-		if eat_nl and self.contents and (not self.contents[-1] or self.contents[-1].isspace()):
-			self.contents.pop()
+		contents = self.contents		# This is called a lot so avoid repeated lookups & work not needed for simple lines.
+		if eat_nl and contents and (not contents[-1] or contents[-1].isspace()):
+			contents.pop()
 		if not text: text = ' '  # Make sure that if nothing else we get a blank line.
 		if isinstance(text, str):
 			text = text.splitlines()
+		elif not isinstance(text, list):
+			text = list(text)
 		if add_nl is not None and add_nl <= 0:
-			self.add_nl()
+			contents.append('')
 		if indent < 0: self.dedent()
-		self.contents += [(' '*self.indent_cols + x).ljust(col_width) + trailer for x in text]
+		prefix = self.indent_prefix
+		if len(text) == 1:
+			contents.append((prefix + text[0]).ljust(col_width) + trailer if col_width else prefix + text[0] + trailer)
+		elif col_width:
+			contents.extend([(prefix + x).ljust(col_width) + trailer for x in text])
+		else:
+			contents.extend([prefix + x + trailer for x in text])
 		if indent > 0: self.indent()
 		if add_nl is not None and add_nl >= 0:
-			self.add_nl()
+			contents.append('')
 
 	def add_include_guard(self):
 		"Add an include guard macro around the contents of the output file. We take care that the macro is reasonable."
@@ -142,7 +236,7 @@ class Codegen:
 		"Add a newline."
 		self.contents.append('')
 
-	def add_avr_array_strings(self, name, strs, col=88, lead_str='DECLARE'):
+	def add_avr_array_strings(self, name, strs, col=88, lead_str='DECLARE', mode='array'):	# pylint: disable=too-many-arguments
 		"""Sometimes I hate AVRs, this nonsense is necessary to declare an array of const strings.
 			add_avr_array_strings('FOO', 'n1 n2'.split()) =>
 				#define DECLARE_FOO()																			\\
@@ -152,23 +246,120 @@ class Codegen:
 				  FOO_0,																						\\
 				  FOO_1,																						\\
 				 }
+			If mode is `pool' the strings are packed into a single array FOO_POOL, strings that are a suffix of another
+			share storage, and an array FOO_OFFSETS of uint16_t holds the offset of each string. Macro FOO_GET(i) gives a
+			PROGMEM pointer to a string. If mode is `compress' common substrings are also replaced by single byte tokens
+			0x80 + n referring to entry n in a dictionary pool FOO_DICT, & a function fooExpand(buf, size, i) is declared
+			to copy a string into a RAM buffer.
 		"""
 		def add(esc_ln):
 			self.add(esc_ln, trailer='\\', col_width=col)
-		add(f"#define {lead_str}_{name.upper()}()")
-		for n, str_n in enumerate(strs):
-			add(f' static const char {name.upper()}_{n}[] PROGMEM = "{str_n}";')
-		add('')
-		add(f' static const char* const {name.upper()}[] PROGMEM = {{')
-		for n in range(len(strs)):
-			add(f'   {name.upper()}_{n},')
-		self.add(' }')
+		name = name.upper()
+		if mode not in STRING_MODES:
+			raise CodegenException(f"unknown string mode `{mode}'.")
+		strs = list(strs)
+		add(f"#define {lead_str}_{name}()")
+		if mode == 'array':
+			for n, str_n in enumerate(strs):
+				add(f' static const char {name}_{n}[] PROGMEM = "{str_n}";')
+			add('')
+			add(f' static const char* const {name}[] PROGMEM = {{')
+			for n in range(len(strs)):
+				add(f'   {name}_{n},')
+			self.add(' }')
+			return
+
+		def add_pool(pool_name, data, last=False):
+			pool, offsets = string_pool(data)
+			if len(pool) > 0xffff:
+				raise CodegenException(f"string pool `{pool_name}' too large for uint16_t offsets.")
+			add(f' static const char {pool_name}_POOL[] PROGMEM =')
+			for piece in pool.split(b'\0')[:-1] if pool else [b'']:
+				add(f'   "{c_string_escape(piece)}\\0"')
+			add('   ;')
+			add(f' static const uint16_t {pool_name}_OFFSETS[] PROGMEM = {{')
+			for offset in offsets:
+				add(f'   {offset},')
+			if last:
+				self.add(' }')
+			else:
+				add(' };')
+
+		data = [codecs.escape_decode(x.encode('utf-8'))[0] for x in strs]		# Resolve any C escapes in the strings.
+		if mode == 'compress':
+			dictionary, data = dict_compress(data)
+			dictionary = dictionary or [b'']		# Avoid an empty array.
+			add_pool(f'{name}_DICT', dictionary)
+		add_pool(name, data, last=mode == 'pool')
+		if mode == 'compress':
+			func = f"{ident_camel(name)}Expand"
+			for ln in f"""\
+ static inline void {func}(char* buf, size_t size, uint16_t idx) {{
+  const char* s = {name}_POOL + pgm_read_word(&{name}_OFFSETS[idx]);
+  char c;
+  while ((size > 1) && (c = pgm_read_byte(s++))) {{
+   if ((uint8_t)c & 0x80) {{
+    const char* d = {name}_DICT_POOL + pgm_read_word(&{name}_DICT_OFFSETS[(uint8_t)c & 0x7f]);
+    while ((size > 1) && (c = pgm_read_byte(d++))) {{ *buf++ = c; size -= 1; }}
+   }}
+   else {{ *buf++ = c; size -= 1; }}
+  }}
+  *buf = '\\0';
+ }}""".splitlines():
+				add(ln)
+			self.add(' static_assert(true, "")')	# Swallows the trailing semicolon.
+		self.add(f'#define {name}_COUNT {len(strs)}')
+		if mode == 'pool':
+			self.add(f'#define {name}_GET(i_) ({name}_POOL + pgm_read_word(&{name}_OFFSETS[(i_)]))')
 
 	def end(self):
 		"Finished writing output file. Will not overwrite if contents have not changed."
 		while self.trailers:
 			self.add(self.trailers.pop())
-		contents = '\n'.join(self.contents) + '\n'
+		contents = self.render()
+		with Verbosity.phase('write'):
+			if self.cache_key:
+				self._store_cache(contents)
+			self._write_output(contents)
+			if self.depfile:
+				self._write_depfile()
+
+	def render(self):
+		"Return the output as a single string."
+		return '\n'.join(self.contents) + '\n'
+
+	def add_dependency(self, fn):
+		"Record a file that was read other than by begin(), for the depfile."
+		self.inputs.append(fn)
+
+	def _write_depfile(self):
+		"""Write a depfile for make or ninja, with an empty rule for each dependency so that make does not fail if one is
+			deleted. Not written if unchanged, or if the output is also an input."""
+		infiles = [self.infile] if isinstance(self.infile, str) else list(self.infile)
+		if self.outfile in infiles + self.inputs:
+			message(f"no depfile for `{self.outfile}' as it is updated in place.\n", Verbosity.DEBUG)
+			return
+		deps = list(dict.fromkeys(script_files() + infiles + self.depends + self.inputs))
+		def esc(fn):
+			"Escape a filename for make."
+			return re.sub(r'([ #])', r'\\\1', fn.replace('$', '$$'))
+		lines = [f"{esc(self.outfile)}: {' '.join(esc(x) for x in deps)}"] + [f"\n{esc(x)}:" for x in deps]
+		contents = '\n'.join(lines) + '\n'
+		fn = self.outfile + '.d'
+		try:
+			with open(fn, 'rt', encoding="utf-8") as fin_r:
+				if fin_r.read() == contents:
+					return
+		except EnvironmentError:
+			pass
+		try:
+			with open(fn, 'wt', encoding="utf-8") as fout_w:
+				fout_w.write(contents)
+		except EnvironmentError:
+			error(f"failed to write depfile `{fn}'.")
+
+	def _write_output(self, contents):
+		"Write the output file if the contents have changed."
 		try:		# Read existing file contents, if any.
 			with open(self.outfile, 'rt', encoding="utf-8") as fout_r:
 				existing = fout_r.read()
@@ -185,6 +376,131 @@ class Codegen:
 				error(f"failed to write output file `{self.outfile}'.")
 			message(f"output file `{self.outfile}' updated.\n")
 
+	def _get_cache_key(self):
+		"Return the cache key as a hex string, or None if a file could not be read."
+		key = hashlib.sha256()
+		key.update(repr((sys.argv[1:], self.outfile)).encode('utf-8'))
+		infiles = [self.infile] if isinstance(self.infile, str) else list(self.infile)
+		for fn in script_files() + infiles + self.depends:
+			try:
+				with open(fn, 'rb') as fin_r:
+					data = fin_r.read()
+			except EnvironmentError:
+				return None
+			key.update(fn.encode('utf-8') + b'\0' + hashlib.sha256(data).digest())
+		return key.hexdigest()
+
+	def _cache_path(self, key):
+		"Return the path of a cache entry."
+		return os.path.join(self.cache_dir, key[:2], key)
+
+	def _check_cache(self):
+		"On a cache hit write the output from the cache and return true, else record the key for end() and return false."
+		self.cache_key = self._get_cache_key()
+		if self.cache_key is None:
+			return False
+		path = self._cache_path(self.cache_key)
+		try:
+			with open(path, 'rt', encoding='utf-8') as fin_r:
+				contents = fin_r.read()
+			os.utime(path)		# Mark as recently used.
+		except EnvironmentError:
+			return False
+		message(f"cache hit {self.cache_key[:16]}, ")
+		self._write_output(contents)
+		if self.depfile:
+			self._write_depfile()
+		return True
+
+	def _store_cache(self, contents):
+		"Add an entry to the cache then remove least recently used entries until the cache is small enough. Errors are ignored."
+		path = self._cache_path(self.cache_key)
+		try:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			fd, tmp_fn = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))	# Unique for concurrent writers.
+			try:
+				with os.fdopen(fd, 'wt', encoding='utf-8') as fout_w:
+					fout_w.write(contents)
+				os.replace(tmp_fn, path)		# Atomic so a concurrent reader never sees a partial entry.
+			except EnvironmentError:
+				os.remove(tmp_fn)
+				raise
+			paths = [os.path.join(dirpath, fn) for dirpath, _, filenames in os.walk(self.cache_dir)
+			  for fn in filenames if not fn.endswith('.tmp')]		# Skip entries being written.
+			entries = {x: os.stat(x) for x in paths}
+			total = sum(x.st_size for x in entries.values())
+			for entry in sorted(entries, key=lambda x: entries[x].st_mtime):
+				if total <= self.cache_size:
+					break
+				os.remove(entry)
+				total -= entries[entry].st_size
+		except EnvironmentError as exc:
+			message(f"cache update failed: {exc}\n", Verbosity.DEBUG)
+
+def script_files():
+	"""Return the filenames of the running script, this module, & any other modules loaded from the same directories, as
+		they may all affect the output."""
+	scripts = [sys.argv[0], __file__]
+	seen = {os.path.abspath(x) for x in scripts}
+	dirs = {os.path.dirname(x) for x in seen}
+	modules = set()
+	for module in list(sys.modules.values()):
+		fn = getattr(module, '__file__', None)
+		if fn and fn.endswith('.py') and os.path.dirname(os.path.abspath(fn)) in dirs and os.path.abspath(fn) not in seen:
+			modules.add(fn)
+	return scripts + sorted(modules)
+
+# Modes for add_avr_array_strings().
+STRING_MODES = ('array', 'pool', 'compress')
+
+def c_string_escape(data):
+	"Return a bytes object as text for a C string literal. Non printable characters are written as 3 digit octal escapes."
+	return ''.join(chr(b) if 0x20 <= b < 0x7f and b not in b'"\\' else f'\\{b:03o}' for b in data)
+
+def string_pool(strs):
+	"""Pack a list of bytes objects into a single bytes object with each terminated by a nul, any that are a suffix of
+		another share its storage. Returns the pool and a list of offsets for each string. Uses the trick that after
+		sorting the reversed strings, a string that is a suffix of any other is a suffix of the next one."""
+	rev = sorted(set(x[::-1] for x in strs))
+	pool, offsets = bytearray(), {}
+	for idx in range(len(rev) - 1, -1, -1):		# Longest first in each run of shared suffixes.
+		s_rev = rev[idx]
+		if idx + 1 < len(rev) and rev[idx + 1].startswith(s_rev):
+			offsets[s_rev] = offsets[rev[idx + 1]] + len(rev[idx + 1]) - len(s_rev)
+		else:
+			offsets[s_rev] = len(pool)
+			pool += s_rev[::-1] + b'\0'
+	return bytes(pool), [offsets[x[::-1]] for x in strs]
+
+def dict_compress(strs, max_entries=128, max_len=16):
+	"""Simple static dictionary compression for 7 bit strings, returns a list of dictionary entries and the list of
+		compressed strings. Greedily picks the substring giving the largest saving, allowing for the cost of the
+		dictionary entry & its offset, and replaces it with a single byte token 0x80 + n until nothing is gained."""
+	if any(b & 0x80 for x in strs for b in x):
+		raise CodegenException("cannot compress strings with 8 bit characters.")
+	def saving(item):
+		"Bytes saved by replacing a substring with a token, less the cost of its dictionary entry & offset."
+		sub, count = item
+		return count * (len(sub) - 1) - (len(sub) + 1 + 2)
+	dictionary, strs = [], list(strs)
+	while len(dictionary) < max_entries:
+		counts = collections.Counter()
+		for text in strs:
+			for start in range(len(text)):
+				for end in range(start + 1, min(start + max_len, len(text)) + 1):
+					if text[end - 1] & 0x80:	# Do not include existing tokens.
+						break
+					if end - start >= 3:
+						counts[text[start:end]] += 1
+		best = max(counts.items(), key=saving, default=None)
+		if best is None or saving(best) <= 0:
+			break
+		best = best[0]
+		token = bytes([0x80 + len(dictionary)])
+		dictionary.append(best)
+		strs = [x.replace(best, token) for x in strs]
+	return dictionary, strs
+
 def include_guard(filepath):
 	"Generate include guard symbol from filename."
 	return 'F_' + ident_allcaps(re.sub(r'\W', '_', os.path.basename(filepath))) + '__'
@@ -340,6 +656,78 @@ foo     // bar''')
 			self.assertEqual(ident_camel('foo BAR'), 'fooBar')
 			self.assertEqual(ident_camel('foo BAR', True), 'FooBar')
 
+	class TestVerbosity(unittest.TestCase):
+		def test_collect(self):
+			with Verbosity.collect() as records:
+				message('hello ', lvl=Verbosity.ERROR, file='foo', line=3)
+				message('not recorded', lvl=Verbosity.DEBUG)
+				with Verbosity.phase('p1'):
+					pass
+				self.assertRaises(CodegenException, error, 'bad')
+			self.assertEqual([(x['level'], x['msg']) for x in records], [('error', 'hello'), ('info', 'phase p1'), ('error', 'Error: bad')])
+			self.assertEqual((records[0]['file'], records[0]['line']), ('foo', 3))
+			self.assertIn('duration', records[1])
+			self.assertTrue(Verbosity.exit_on_error)
+			self.assertIsNone(Verbosity.collector)
+		def test_phase_level(self):
+			saved = Verbosity.level
+			Verbosity.level = Verbosity.ERROR
+			try:
+				with Verbosity.collect() as records:
+					with Verbosity.phase('p1'):
+						pass
+			finally:
+				Verbosity.level = saved
+			self.assertEqual(records, [])
+
+	class TestCodegenAdd(unittest.TestCase):
+		def test_add(self):
+			gen = Codegen('in', 'out')
+			gen.add('a\nb', add_nl=-1)
+			gen.add(['c'], indent=1, trailer='\\', col_width=4)
+			gen.add(x for x in 'de')
+			gen.add('', add_nl=0)
+			gen.add('f', eat_nl=True, indent=-1)
+			gen.add_comment('g', add_nl=+1)
+			self.assertEqual(gen.contents, ['', 'a', 'b', 'c   \\', '    d', '    e', '', '     ', 'f', '// g', ''])
+
+	class TestCodegenCache(unittest.TestCase):
+		def test_hit_raises_in_process(self):
+			with tempfile.TemporaryDirectory() as tmp_dir:
+				in_fn, out_fn = os.path.join(tmp_dir, 'in.txt'), os.path.join(tmp_dir, 'out.h')
+				with open(in_fn, 'wt', encoding='utf-8') as fout_w:
+					fout_w.write('foo\n')
+				with Verbosity.collect():
+					for expect_hit in (False, True):
+						gen = Codegen(in_fn, out_fn)
+						gen.cache_dir = os.path.join(tmp_dir, 'cache')
+						if expect_hit:
+							self.assertRaises(CodegenCacheHit, gen.begin)
+						else:
+							gen.add(gen.begin())
+							gen.end()
+				with open(out_fn, 'rt', encoding='utf-8') as fin_r:
+					self.assertEqual(fin_r.read(), 'foo\n')
+
+	class TestStringPool(unittest.TestCase):
+		def test_escape(self):
+			self.assertEqual(c_string_escape(b'a"b\\c\n\x80'), 'a\\042b\\134c\\012\\200')
+		def test_pool(self):
+			pool, offsets = string_pool([b'foo', b'barfoo', b'oo', b'x', b'foo'])
+			self.assertEqual(len(pool), len(b'barfoo\0x\0'))
+			for text, offset in zip([b'foo', b'barfoo', b'oo', b'x', b'foo'], offsets):
+				self.assertEqual(pool[offset:].split(b'\0')[0], text)
+		def test_compress(self):
+			strs = [b'motor run time', b'motor stop time', b'pump run time', b'x']
+			dictionary, compressed = dict_compress(strs)
+			self.assertTrue(dictionary)
+			self.assertLess(sum(map(len, compressed + dictionary)), sum(map(len, strs)))
+			def expand(text):
+				return b''.join(dictionary[b & 0x7f] if b & 0x80 else bytes([b]) for b in text)
+			self.assertEqual([expand(x) for x in compressed], strs)
+		def test_compress_8bit(self):
+			self.assertRaises(CodegenException, dict_compress, [b'\xff'])
+
 	class TestRegionParser(unittest.TestCase):
 		S = (
 			['leader 1', 'leader 3'],
@@ -0,0 +1,67 @@
+#! /usr/bin/python3
+
+"""Benchmark for Codegen.add() & rendering the output. A synthetic workload like that of events_mk.py, padded macro lines
+	with trailers, comments & indented enum blocks, is run through Codegen and through LineCodegen, the previous
+	implementation that built each line through a list comprehension & always padded. The outputs are checked to be
+	identical.
+"""
+
+import sys, time, argparse
+import codegen
+
+class LineCodegen(codegen.Codegen):
+	"Codegen with the previous add()."
+	def add(self, text, eat_nl=False, add_nl=None, trailer='', col_width=0, indent=0): # pylint: disable=too-many-arguments
+		"Add text as for Codegen.add()."
+		if eat_nl and self.contents and (not self.contents[-1] or self.contents[-1].isspace()):
+			self.contents.pop()
+		if not text: text = ' '  # Make sure that if nothing else we get a blank line.
+		if isinstance(text, str):
+			text = text.splitlines()
+		if add_nl is not None and add_nl <= 0:
+			self.add_nl()
+		if indent < 0: self.dedent()
+		self.contents += [(' '*self.indent_cols + x).ljust(col_width) + trailer for x in text]
+		if indent > 0: self.indent()
+		if add_nl is not None and add_nl >= 0:
+			self.add_nl()
+
+def workload(cg_bench, n_items):
+	"Generate output like events_mk.py for n_items events, return the output as a string."
+	cg_bench.add_comment('Event IDs.', add_nl=-1)
+	cg_bench.add('enum {', indent=+1)
+	for idx in range(n_items):
+		cg_bench.add(f'EV_EVENT_{idx} = {idx},', trailer=f'// Description of event {idx}.', col_width=40)
+	cg_bench.add('};', indent=-1, add_nl=+1)
+	cg_bench.add('#define DECLARE_EVENT_NAMES()', trailer='\\', col_width=88)
+	for idx in range(n_items):
+		cg_bench.add(f' static const char EVENT_NAMES_{idx}[] PROGMEM = "EVENT_{idx}";', trailer='\\', col_width=88)
+	cg_bench.add('')
+	for idx in range(n_items // 10):
+		cg_bench.add_comment(f'Group {idx}\nof events.', add_nl=-1)
+		cg_bench.add(f'enum {{\nGROUP_{idx}_FIRST = {idx * 10},\nGROUP_{idx}_LAST = {idx * 10 + 9},\n}};', eat_nl=True)
+	return cg_bench.render()
+
+def bench(cls, n_items, repeat):
+	"Return the best time for the workload and the output."
+	def run():
+		cg_bench = cls('bench.in', 'bench.h')
+		t_start = time.perf_counter()
+		output = workload(cg_bench, n_items)
+		return time.perf_counter() - t_start, output
+	results = [run() for _ in range(repeat)]
+	return min(x[0] for x in results), results[0][1]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark Codegen.add() against the previous implementation.')
+	parser.add_argument('-n', '--items', type=int, action='append', help='number of events in the workload, may be repeated')
+	parser.add_argument('-r', '--repeat', type=int, default=5, help='number of runs for each case, best time is used')
+	options = parser.parse_args()
+
+	for items in options.items or (1000, 10000):
+		t_prev, out_prev = bench(LineCodegen, items, options.repeat)
+		t_now, out_now = bench(codegen.Codegen, items, options.repeat)
+		if out_prev != out_now:
+			print(f"items={items}: outputs differ!", file=sys.stderr)
+			sys.exit(1)
+		print(f"items={items}: previous {t_prev*1000:.2f}ms, current {t_now*1000:.2f}ms ({t_prev/t_now:.2f}x)")
@@ -2,10 +2,14 @@
 
 """Open an input file and write it back with text like `case /** <xxx> **/ 0xb58b:'
 	having the hex chars replaced with a hash of the printable chars <xxx>.
+	All commands in all files are checked for hash collisions before any file is written, and a minimal perfect hash
+	of the command hashes may be written as a header for O(1) dispatch. A registry of all commands may also be written
+	as a header with a sorted hash table and a JSON file with the location of each command.
 """
 
 import re
-import sys
+import json
+import argparse
 import glob
 import codegen
 
@@ -18,14 +22,199 @@ def do_hash(cmd_s):
 		hash_c = ((hash_c * HASH_MULT) & 0xffff) ^ ord(cmd_ch)
 	return hash_c
 
+RE_CMD = re.compile(r'/\*\*\s*(\S+)\s*\*\*/\s*(0[x])?([0-9a-f]*)', re.I)
+
 def subber_hash(m):
 	"Produce a C snippet containing a 16 bit hash from a string in a regex match."
 	cmd_s = m.group(1).upper()
 	return f'/** {cmd_s} **/ 0x{do_hash(cmd_s):04x}'
 
-for infile in glob.glob(sys.argv[1], recursive=True):
-	cg = codegen.Codegen(infile, infile)
-	text = cg.begin()
+def find_commands(fn, src):
+	"Return a list of (command, hash, filename, lineno) for each command in the text of a file."
+	return [(m.group(1).upper(), do_hash(m.group(1).upper()), fn, src.count('\n', 0, m.start()) + 1)
+	  for m in RE_CMD.finditer(src)]
+
+def check_collisions(commands):
+	"Return a list of error messages for distinct commands with the same hash."
+	by_hash = {}		# Map of hash to map of command to first location.
+	for cmd_s, hash_c, fn, lineno in commands:
+		by_hash.setdefault(hash_c, {}).setdefault(cmd_s, f'{fn}:{lineno}')
+	return [f"hash 0x{hash_c:04x} collision: {', '.join(f'{c} at {loc}' for c, loc in cmds.items())}"
+	  for hash_c, cmds in by_hash.items() if len(cmds) > 1]
+
+MPH_MULT = 0x9e37		# Multiplier for mph_mix(), the same constant is used in the generated C.
+
+def mph_mix(hash_c, seed):
+	"Mix a 16 bit command hash with a seed, must match consoleMphMix() in the generated header."
+	mixed = ((hash_c ^ seed) * MPH_MULT) & 0xffff
+	return mixed ^ (mixed >> 7)
+
+def build_mph(hashes, max_tries=64):
+	"""Build a minimal perfect hash for a list of distinct 16 bit hashes by hash & displace. Keys are put in buckets by
+		mph_mix(hash, bucket_seed), then for each bucket, largest first, a displacement d is searched for that puts all
+		its keys in free slots at mph_mix(hash, d) % n. Returns the bucket seed, the displacements and the table of
+		hashes by slot, or None if no solution was found."""
+	n_keys = len(hashes)
+	n_buckets = max(1, (n_keys + 1) // 2)
+	for bucket_seed in range(max_tries):
+		buckets = [[] for _ in range(n_buckets)]
+		for hash_c in hashes:
+			buckets[mph_mix(hash_c, bucket_seed) % n_buckets].append(hash_c)
+		disp, slots = [0] * n_buckets, [None] * n_keys
+		for b_idx in sorted(range(n_buckets), key=lambda x: -len(buckets[x])):	# pylint: disable=cell-var-from-loop
+			if not buckets[b_idx]:
+				break
+			for d_val in range(1, 0x10000):
+				pos = [mph_mix(h, d_val) % n_keys for h in buckets[b_idx]]
+				if len(set(pos)) == len(pos) and all(slots[p] is None for p in pos):
+					break
+			else:
+				break		# Failed, try another bucket seed.
+			disp[b_idx] = d_val		# pylint: disable=undefined-loop-variable
+			for slot, hval in zip(pos, buckets[b_idx]):
+				slots[slot] = hval
+		if None not in slots:
+			return bucket_seed, disp, slots
+	return None
+
+def write_mph_header(fn, infiles, commands):
+	"Write a header with a minimal perfect hash for the commands."
+	names = {hash_c: cmd_s for cmd_s, hash_c, _, _ in commands}		# Map of hash to command name.
+	if not names:
+		codegen.error("no commands found for perfect hash.")
+	mph = build_mph(sorted(names))
+	if mph is None:
+		codegen.error("failed to find a minimal perfect hash for the commands.")
+	bucket_seed, disp, slots = mph
+	disp_type = 'uint8_t' if max(disp, default=0) < 256 else 'uint16_t'
+	disp_read = 'pgm_read_byte' if disp_type == 'uint8_t' else 'pgm_read_word'
+
+	cg_out = codegen.Codegen(infiles, fn)
+	cg_out.add_autogen_comment()
+	cg_out.add_include_guard()
+	cg_out.add_comment('Minimal perfect hash of console command hashes. consoleMphLookup() returns the index of a command from '
+	  'its hash,\nor -1 if it is not a command.')
+	cg_out.add(f'#define CONSOLE_MPH_COUNT {len(slots)}')
+	cg_out.add(f'#define CONSOLE_MPH_BUCKET_SEED {bucket_seed}')
+	cg_out.add(f'#define CONSOLE_MPH_BUCKETS {len(disp)}', add_nl=+1)
+	cg_out.add_comment('Command indices.')
+	cg_out.add('enum {', indent=+1)
+	for idx, hash_c in enumerate(slots):
+		if codegen.is_ident(names[hash_c]):
+			cg_out.add(f'CONSOLE_CMD_IDX_{names[hash_c]} = {idx},', trailer=f'// 0x{hash_c:04x}', col_width=40)
+	cg_out.add('};', indent=-1, add_nl=+1)
+	cg_out.add(codegen.mk_short_function('consoleMphMix',
+	  f'h ^= s; h *= 0x{MPH_MULT:04x}U; return h ^ (h >> 7);', ret='uint16_t', args='uint16_t h, uint16_t s',
+	  leader='static inline'), add_nl=+1)
+
+	def add_macro(macro_ln):
+		"Add a line with a trailing backslash."
+		cg_out.add(macro_ln, trailer='\\', col_width=100)
+	add_macro('#define CONSOLE_DECLARE_MPH()')
+	add_macro(f' static const {disp_type} CONSOLE_MPH_DISP[] PROGMEM = {{')
+	add_macro(f"   {', '.join(map(str, disp))}")
+	add_macro(' };')
+	add_macro(' static const uint16_t CONSOLE_MPH_HASHES[] PROGMEM = {')
+	for hash_c in slots:
+		add_macro(f'   0x{hash_c:04x},  /* {names[hash_c]} */')
+	add_macro(' };')
+	add_macro(' static inline int8_t consoleMphLookup(uint16_t hash) {')
+	add_macro('  const uint8_t idx = consoleMphMix(hash, '
+	  f'{disp_read}(&CONSOLE_MPH_DISP[consoleMphMix(hash, CONSOLE_MPH_BUCKET_SEED) % CONSOLE_MPH_BUCKETS])) % CONSOLE_MPH_COUNT;')
+	add_macro('  return (pgm_read_word(&CONSOLE_MPH_HASHES[idx]) == hash) ? (int8_t)idx : -1;')
+	add_macro(' }')
+	cg_out.add(' static_assert(CONSOLE_MPH_COUNT <= 127, "Too many commands for int8_t index.")')
+	codegen.message(f"{cg_out.script}: ")
+	cg_out.end()
+
+def get_registry(commands):
+	"Return a list of dicts for each distinct command with its hash and list of locations, sorted by hash."
+	registry = {}
+	for cmd_s, hash_c, fn, lineno in commands:
+		registry.setdefault(cmd_s, {'name': cmd_s, 'hash': hash_c, 'locations': []})['locations'].append(
+		  {'file': fn, 'line': lineno})
+	return sorted(registry.values(), key=lambda x: x['hash'])
 
-	cg.add(re.sub(r'/\*\*\s*(\S+)\s*\*\*/\s*(0[x])?([0-9a-f]*)', subber_hash, text, flags=re.I))
+def write_registry(basename, infiles, commands):
+	"Write a header with a table of command hashes sorted for binary search, and a JSON file listing the commands."
+	registry = get_registry(commands)
+	cg_out = codegen.Codegen(infiles, basename + '.h')
+	cg_out.add_autogen_comment()
+	cg_out.add_include_guard()
+	cg_out.add_comment('Registry of console commands, sorted by hash. consoleRegistryFind() returns the index of a command '
+	  'from its hash,\nor -1 if it is not a command.')
+	cg_out.add(f'#define CONSOLE_REGISTRY_COUNT {len(registry)}', add_nl=+1)
+
+	def add_macro(macro_ln):
+		"Add a line with a trailing backslash."
+		cg_out.add(macro_ln, trailer='\\', col_width=100)
+	add_macro('#define CONSOLE_DECLARE_REGISTRY()')
+	add_macro(' static const uint16_t CONSOLE_REGISTRY_HASHES[] PROGMEM = {')
+	for cmd in registry:
+		add_macro(f"   0x{cmd['hash']:04x},  /* {cmd['name']} */")
+	add_macro(' };')
+	add_macro(' static inline int16_t consoleRegistryFind(uint16_t hash) {')
+	add_macro('  int16_t lo = 0, hi = CONSOLE_REGISTRY_COUNT - 1;')
+	add_macro('  while (lo <= hi) {')
+	add_macro('   const int16_t mid = (lo + hi) / 2;')
+	add_macro('   const uint16_t h = pgm_read_word(&CONSOLE_REGISTRY_HASHES[mid]);')
+	add_macro('   if (h == hash) return mid;')
+	add_macro('   if (h < hash) lo = mid + 1; else hi = mid - 1;')
+	add_macro('  }')
+	add_macro('  return -1;')
+	add_macro(' }')
+	cg_out.add(' static_assert(true, "")', add_nl=+1)	# Swallows the trailing semicolon.
+	cg_out.add_comment('Command names in the same order as the hashes.')
+	cg_out.add_avr_array_strings('CONSOLE_REGISTRY_NAMES', [x['name'] for x in registry], lead_str='CONSOLE_DECLARE')
+	codegen.message(f"{cg_out.script}: ")
+	cg_out.end()
+
+	cg_out = codegen.Codegen(infiles, basename + '.json')
+	cg_out.add(json.dumps({'commands': registry}, indent=1))
+	codegen.message(f"{cg_out.script}: ")
+	cg_out.end()
+
+def scan_file(fn):
+	"Read a file and find the commands in it, returns the text, or None on error, and a list of commands."
+	try:
+		with open(fn, 'rt', encoding='utf-8') as fin_r:
+			src = fin_r.read()
+	except EnvironmentError:
+		return None, []
+	return src, find_commands(fn, src)
+
+arg_parser = argparse.ArgumentParser(description='Update console command hashes in source files.')
+arg_parser.add_argument('infiles', nargs='+', help='input files, may be glob patterns like `src/**/*.cpp\'')
+arg_parser.add_argument('--perfect-hash', dest='mph_fn', help='write a minimal perfect hash of the commands to this header')
+arg_parser.add_argument('--registry', dest='registry_fn',
+	help='write a registry of all commands to this file with extensions `.h\' and `.json\' added')
+codegen.Verbosity.add_argparse_options(arg_parser)
+options = arg_parser.parse_args()
+codegen.Verbosity.parse_options(options)	# Sort out verbosity.
+
+# Read all files and find all commands before writing anything, so that collisions are found first.
+infile_list = list(dict.fromkeys(fn for pattern in options.infiles for fn in glob.glob(pattern, recursive=True)))
+sources = {}		# Map of filename to text.
+all_commands = []
+for infile in infile_list:
+	src_text, src_commands = scan_file(infile)
+	if src_text is None:
+		codegen.error(f"failed to read `{infile}'.")
+	codegen.message(f"{arg_parser.prog}: read input file `{infile}', {len(src_commands)} commands.\n")
+	sources[infile] = src_text
+	all_commands += src_commands
+
+collisions = check_collisions(all_commands)
+if collisions:
+	codegen.error('\n'.join(collisions))
+
+for infile, text in sources.items():
+	cg = codegen.Codegen(infile, infile)
+	cg.add(RE_CMD.sub(subber_hash, text))
+	codegen.message(f"{cg.script}: ")
 	cg.end()
+
+if options.mph_fn:
+	write_mph_header(options.mph_fn, list(sources), all_commands)
+if options.registry_fn:
+	write_registry(options.registry_fn, list(sources), all_commands)
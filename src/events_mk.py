@@ -13,6 +13,7 @@ TEMPLATE_FILE = '''\
 #  <name> [<group>] "<description>"
 #   <name> is a C identifier, usually all caps, will have "EV_" prepended and used in an enum.
 #   <group> is a C identifier used to identify a group of events for a predefined trace mask. There may be multiple groups.
+#     Groups may be hierarchical like `motor.pwm', an event in a group is also in the parent group `motor'.
 #   <description" is a short sentence.
 
 SAMPLE_1	[default]			Frobs the foo.
@@ -24,6 +25,10 @@ arg_parser = argparse.ArgumentParser(
 )
 arg_parser.add_argument('infile', help='input files', default=[DEFAULT_SRC_FILE], nargs='*')
 arg_parser.add_argument('--output', '-o', help="output file, default input file with extension '.h'", dest='output_fn')
+arg_parser.add_argument('--strings', choices=codegen.STRING_MODES, default='array',
+	help='how name & description strings are declared, see codegen.Codegen.add_avr_array_strings()')
+arg_parser.add_argument('--trace-masks', choices=('bitmap', 'ranges', 'both'), default='bitmap',
+	help='declare trace masks as a bitmap per group, and/or as ranges of event IDs with runtime helpers')
 arg_parser.add_argument('--write-template', help='write example input file', action='store_true', dest='write_template')
 def __define_symbol(symbol_def):
 	try:
@@ -99,6 +104,9 @@ for ll in sum(cg.begin(reader=read_logical_lines), []):
 		codegen.error(f"failed to parse definition at {loc}")
 	ev_groups = [] if not raw_groups else raw_groups.lower().split()
 	ev_groups.append('all')
+	for ev_group in list(ev_groups):	# Groups may be hierarchical like `motor.pwm', an event is also in all parent groups.
+		ev_groups += ['.'.join(ev_group.split('.')[:depth]) for depth in range(1, ev_group.count('.') + 1)]
+	ev_groups = list(dict.fromkeys(ev_groups))
 
 	def __add_event(e_n, e_gps, e_desc):
 		" Add a single event to the collection."
@@ -106,7 +114,7 @@ for ll in sum(cg.begin(reader=read_logical_lines), []):
 			codegen.error(f"event {e_n} at {loc} already exists.") 	#pylint: disable=cell-var-from-loop
 		for x in e_gps:
 			if x not in groups:
-				groups[x] = 0
+				groups[x] = None
 		events[e_n] = e_gps, e_desc
 
 	if not ev_multi:
@@ -124,12 +132,12 @@ for ll in sum(cg.begin(reader=read_logical_lines), []):
 # Compute size of mask. Since we access this as 16 bit words, round up size.
 MASK_SIZE = 2 * ((len(events)+15)//16)
 
-# Compute trace masks.
-for ev_g in [x[0] for x in reversed(events.values())]:
-	for g in groups:
-		groups[g] <<= 1
-		if g in ev_g:
-			groups[g] |= 1
+# Compute trace masks, a bitset for each group with bit n set if event n is in the group.
+for g in groups:
+	groups[g] = bytearray((len(events) + 7) // 8)
+for n, ev_g in enumerate(x[0] for x in events.values()):
+	for g in ev_g:
+		groups[g][n >> 3] |= 1 << (n & 7)
 
 # We have enough to generate the event definitions.
 cg.add_autogen_comment()
@@ -153,23 +161,102 @@ cg.add_nl()
 cg.add_comment('Size of trace mask in bytes.')
 cg.add(f'#define EVENT_TRACE_MASK_SIZE {MASK_SIZE}', add_nl=+1)
 
+def group_ident(grp):
+	"Make a C identifier fragment from a group name, which may have `.' separators."
+	return grp.upper().replace('.', '_')
+
 # Generate some tracemasks.
-for g,v in groups.items():
-	cg.add_comment(f'Trace mask {g}.')
-	cg.add(
-	  f"#define EVENT_DECLARE_TRACE_MASK_{g.upper()}() static const uint8_t TRACE_MASK_{g.upper()}[] PROGMEM = {{",
-	  indent=1, trailer='\\', col_width=100)
-	cg.add(', '.join([f"0x{(v >> n) & 0xff:02x}" for n in range(0, len(events), 8)]), trailer='\\', col_width=100)
-	cg.add("}", indent=-1, add_nl=1)
+if options.trace_masks in ('bitmap', 'both'):
+	for g,v in groups.items():
+		cg.add_comment(f'Trace mask {g}.')
+		cg.add(
+		  f"#define EVENT_DECLARE_TRACE_MASK_{group_ident(g)}() static const uint8_t TRACE_MASK_{group_ident(g)}[] PROGMEM = {{",
+		  indent=1, trailer='\\', col_width=100)
+		cg.add(', '.join([f"0x{b:02x}" for b in v]), trailer='\\', col_width=100)
+		cg.add("}", indent=-1, add_nl=1)
+
+def get_ranges(mask):
+	"Return a list of (first, end) ranges of event IDs set in a group bitset, end is one past the last."
+	mask_ranges = []
+	for ev_id in range(len(events)):
+		if mask[ev_id >> 3] & (1 << (ev_id & 7)):
+			if mask_ranges and mask_ranges[-1][1] == ev_id:
+				mask_ranges[-1][1] = ev_id + 1
+			else:
+				mask_ranges.append([ev_id, ev_id + 1])
+	return mask_ranges
+
+# Trace masks as ranges of event IDs, which are much smaller for sparse groups. Helper functions build a mask in RAM
+#  as the union, intersection or difference of groups.
+if options.trace_masks in ('ranges', 'both'):
+	group_ranges = {g: get_ranges(v) for g, v in groups.items()}
+	RANGE_TYPE = 'uint8_t' if len(events) < 256 else 'uint16_t'
+	RANGE_READ = 'pgm_read_byte' if len(events) < 256 else 'pgm_read_word'
+	range_idx, n_ranges = [], 0
+	for r in group_ranges.values():
+		range_idx.append(n_ranges)
+		n_ranges += len(r)
+	range_idx.append(n_ranges)
+	IDX_TYPE = 'uint8_t' if n_ranges < 256 else 'uint16_t'
+	IDX_READ = 'pgm_read_byte' if n_ranges < 256 else 'pgm_read_word'
+
+	cg.add_comment('Trace mask groups, stored as ranges of event IDs.')
+	cg.add('enum {', indent=+1)
+	for n, g in enumerate(groups):
+		cg.add(f'EVENT_TRACE_GROUP_{group_ident(g)} = {n},', trailer=f'// {len(group_ranges[g])} ranges.', col_width=40)
+	cg.add(f'COUNT_EVENT_TRACE_GROUP = {len(groups)},', trailer='// Total number of groups.', col_width=40)
+	cg.add('};', indent=-1, add_nl=1)
+
+	def add_macro(macro_ln):
+		"Add a line with a trailing backslash."
+		cg.add(macro_ln, trailer='\\', col_width=100)
+	add_macro('#define EVENT_DECLARE_TRACE_GROUPS()')
+	add_macro(f' static const {RANGE_TYPE} TRACE_GROUP_RANGES[][2] PROGMEM = {{')
+	for g, g_ranges in group_ranges.items():
+		add_macro(f"   /* {g} */ {' '.join(f'{{{r[0]}, {r[1]}}},' for r in g_ranges)}")
+	add_macro(' };')
+	add_macro(f' static const {IDX_TYPE} TRACE_GROUP_RANGE_IDX[] PROGMEM = {{')
+	add_macro(f"   {', '.join(map(str, range_idx))}")
+	add_macro(' };')
+	for ln in f'''\
+ static inline void eventTraceMaskSetRange(uint8_t* mask, uint16_t first, uint16_t end, bool set) {{
+  while (first < end) {{
+   if (((first & 7) == 0) && ((end - first) >= 8)) {{ mask[first >> 3] = set ? 0xff : 0x00; first += 8; }}
+   else {{
+    if (set) mask[first >> 3] |= (uint8_t)(1U << (first & 7));
+    else     mask[first >> 3] &= (uint8_t)~(1U << (first & 7));
+    first += 1;
+   }}
+  }}
+ }}
+ static inline void eventTraceMaskClear(uint8_t* mask) {{ eventTraceMaskSetRange(mask, 0, EVENT_TRACE_MASK_SIZE * 8, false); }}
+ static inline void eventTraceMaskGroup(uint8_t* mask, uint8_t group, bool set) {{
+  const {IDX_TYPE} end = {IDX_READ}(&TRACE_GROUP_RANGE_IDX[group + 1]);
+  for ({IDX_TYPE} i = {IDX_READ}(&TRACE_GROUP_RANGE_IDX[group]); i < end; i += 1)
+   eventTraceMaskSetRange(mask, {RANGE_READ}(&TRACE_GROUP_RANGES[i][0]), {RANGE_READ}(&TRACE_GROUP_RANGES[i][1]), set);
+ }}
+ static inline void eventTraceMaskAddGroup(uint8_t* mask, uint8_t group) {{ eventTraceMaskGroup(mask, group, true); }}
+ static inline void eventTraceMaskRemoveGroup(uint8_t* mask, uint8_t group) {{ eventTraceMaskGroup(mask, group, false); }}
+ static inline void eventTraceMaskIntersectGroup(uint8_t* mask, uint8_t group) {{
+  const {IDX_TYPE} end = {IDX_READ}(&TRACE_GROUP_RANGE_IDX[group + 1]);
+  uint16_t prev = 0;
+  for ({IDX_TYPE} i = {IDX_READ}(&TRACE_GROUP_RANGE_IDX[group]); i < end; i += 1) {{
+   eventTraceMaskSetRange(mask, prev, {RANGE_READ}(&TRACE_GROUP_RANGES[i][0]), false);
+   prev = {RANGE_READ}(&TRACE_GROUP_RANGES[i][1]);
+  }}
+  eventTraceMaskSetRange(mask, prev, EVENT_TRACE_MASK_SIZE * 8, false);
+ }}'''.splitlines():
+		add_macro(ln)
+	cg.add(' static_assert(true, "")', add_nl=1)	# Swallows the trailing semicolon.
 
 # Event names as strings.
 cg.add_comment('Event Names.')
-cg.add_avr_array_strings('EVENT_NAMES', events.keys(), lead_str='EVENT_DECLARE')
+cg.add_avr_array_strings('EVENT_NAMES', events.keys(), lead_str='EVENT_DECLARE', mode=options.strings)
 cg.add_nl()
 
 # Event descriptions as strings.
 cg.add_comment('Event Descriptions.')
-cg.add_avr_array_strings('EVENT_DESCS', [x[1] for x in events.values()], col=140, lead_str='EVENT_DECLARE')
+cg.add_avr_array_strings('EVENT_DESCS', [x[1] for x in events.values()], col=140, lead_str='EVENT_DECLARE', mode=options.strings)
 cg.add_nl()
 
 # Finalise output file.
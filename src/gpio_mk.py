@@ -2,17 +2,22 @@
 
 """Code generator to turn a CSV representation of GPIO signals into a bunch of definitions for a C header file.
 """
-import re, os, argparse
+import re, os, json, argparse, functools
 import csv_parser
 import codegen
 
 INFILE_DEFAULT = 'gpio.csv'
+PROCESSORS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gpio_processors.json')
 
 # Parse command line arguments.
 arg_parser = argparse.ArgumentParser(
 	description='Code generator to turn a CSV representation of GPIO signals into definitions in a C header file.')
 arg_parser.add_argument('infile', default=INFILE_DEFAULT, help='Input csv file.')
 arg_parser.add_argument('--output', '-o', default=None, help="output file, default input file with extension '.h'")
+arg_parser.add_argument('--processors', '-p', action='append', default=[],
+	help='extra processor description JSON file, families override those in gpio_processors.json')
+arg_parser.add_argument('--check-alt-funcs', action='store_true',
+	help='check that each function of a pin other than direct, input, output etc. is listed in its alternate functions')
 
 codegen.Verbosity.add_argparse_options(arg_parser)
 options = arg_parser.parse_args()
@@ -20,6 +25,32 @@ codegen.Verbosity.parse_options(options)	# Sort out verbosity.
 if not options.output:
 	options.output = os.path.splitext(os.path.basename(options.infile))[0] + '.h'	# Write to current directory
 
+@functools.lru_cache(maxsize=None)
+def load_processors(filename):
+	"""Load a processor description file, a JSON object keyed by family. Each family has a regex `port_regex' with
+		groups `port' & `bit', register names `registers' formatted with the port for `out', `in' and optionally `dir',
+		`toggle', `set' & `clear' for atomic writes, the register `width' and a `bit_mask' formatted with the bit.
+		Results are cached as the file will not change during a run."""
+	try:
+		with open(filename, 'rt', encoding='utf-8') as fin:
+			procs = json.load(fin)
+	except (EnvironmentError, ValueError) as exc:
+		codegen.error(f"failed to read processor descriptions from `{filename}': {exc}")
+	for family, proc_desc in procs.items():
+		missing = [k for k in ('port_regex', 'width', 'bit_mask', 'registers') if k not in proc_desc]
+		missing += [f'registers.{k}' for k in ('out', 'in') if k not in proc_desc.get('registers', {})]
+		if missing:
+			codegen.error(f"processor `{family}' in `{filename}' missing {', '.join(missing)}")
+		proc_desc['port_re'] = re.compile(proc_desc['port_regex'])
+	return procs
+
+def get_processors():
+	"Return a dict of all processor descriptions by family."
+	procs = {}
+	for filename in [PROCESSORS_FILE] + options.processors:
+		procs.update(load_processors(filename))
+	return procs
+
 class GPIOParse(csv_parser.CSVparse):
 	"""Class to handle parsing a CSV file with GPIO definitions.
 
@@ -30,6 +61,7 @@ class GPIOParse(csv_parser.CSVparse):
 		csv_parser.CSVparse.__init__(self)
 		self.COLUMN_NAMES = 'Pin Sig Func Description Group Apin Ppin Port AltFunc Comment'.split() # pylint: disable=invalid-name
 		self.metadata = { 'symbol': {}}
+		self.processor = None	# Processor description, set from the processor directive.
 
 	# Directives...
 	def handle_directive_processor(self, directive, data):
@@ -50,10 +82,14 @@ class GPIOParse(csv_parser.CSVparse):
 		if not codegen.is_ident(macro):
 			self.error(f"bad symbol name `{macro}'")
 		self.metadata['symbol'][macro] = d_val, d_comment
+	def preprocess(self, row):
+		"Record the line number of each row for error messages."
+		row['lineno'] = self.lineno
 	def on_first_data(self):
 		"Validate that we have the correct metadata."
 		p_family = self.metadata.get('processor', ['*none*'])[0]
-		if p_family != 'avr8':
+		self.processor = get_processors().get(p_family)
+		if self.processor is None:
 			self.error(f"cannot use processor `{p_family}'")
 
 	# Data, these are mostly static methods as they do not need instance or class access.
@@ -76,19 +112,53 @@ class GPIOParse(csv_parser.CSVparse):
 		return x or 'None'
 	def validate_col_Port(self, port): # pylint: disable=invalid-name
 		"""Expected either blank or port like `PA3'."""
-		# If present then set extra keys to row io_port & io_bit.
-		# TODO: Pattern should be configurable for diffferent processors.
-		if port.startswith('P'):
-			m = re.match(r'(?:(?:P([A-Z]))|(ADC))([0-7])$', port)	# Parse out port, bit from like `PA3'.
-			self.add_extra('io_port', m.group(1) or m.group(2))
-			self.add_extra('io_bit', int(m.group(3)))
+		# If present then set extra keys to row io_port & io_bit, the pattern is from the processor description.
+		m = self.processor['port_re'].match(port)
+		if m:
+			self.add_extra('io_port', m.group('port'))
+			self.add_extra('io_bit', int(m.group('bit')))
 		return port
 
 # Parse...
-cg = codegen.Codegen(options.infile, options.output)
+cg = codegen.Codegen(options.infile, options.output, depends=[PROCESSORS_FILE] + options.processors)
 parser = GPIOParse()
 cg.begin(parser.read)
 
+def func_keywords(func_cell):
+	"Return the set of lower case keywords in a Func cell, separated by commas, slashes or whitespace."
+	return {x.lower() for x in re.split(r'[\s,/]+', func_cell) if x}
+
+# Keywords in Func that are not an alternate function of the pin, for option --check-alt-funcs.
+GENERIC_FUNCS = frozenset('direct input output unused high pullup active low'.split())
+
+def check_conflicts(rows, check_alt_funcs=False):
+	"""Check for conflicts in the parsed rows, returns a list of messages. Indexes of port/bit to rows, pin to rows &
+		signal to rows are built in a single pass, then any key with more than one row is a conflict. If check_alt_funcs
+		is set then Func keywords that are not generic & not listed in the AltFunc column of the pin are also reported."""
+	indexes = {'port': {}, 'pin': {}, 'signal': {}}
+	errors = []
+	for row in rows:
+		if 'io_port' in row:
+			indexes['port'].setdefault(row['Port'], []).append(row)
+		if row['Pin']:
+			indexes['pin'].setdefault(row['Pin'], []).append(row)
+		if row['Sig']:
+			indexes['signal'].setdefault(row['Sig'], []).append(row)
+		if check_alt_funcs:
+			alt_funcs = func_keywords(row['AltFunc'])
+			for keyword in sorted(func_keywords(row['Func']) - GENERIC_FUNCS - alt_funcs):
+				errors.append(f"line {row['lineno']}: function {keyword.upper()} is not an alternate function of pin {row['Pin']}.")
+	for what, index in indexes.items():
+		for key, users in index.items():
+			if len(users) > 1:
+				errors.append(f"{what} {key} used more than once: " +
+				  ', '.join(f"{x['Sig'] or x['Pin'] or '<none>'} at line {x['lineno']}" for x in users) + '.')
+	return errors
+
+conflicts = check_conflicts(parser.data, options.check_alt_funcs)
+if conflicts:
+	codegen.error(f"conflicts in `{options.infile}':\n  " + '\n  '.join(conflicts))
+
 # Postprocess a bit...
 pins = {}
 direct = []
@@ -104,7 +174,9 @@ for d in parser.data:
 	pins[d['Group']].append((f"GPIO_PIN_{d['Sig']} = {d['Pin']}", d['Description']))		# Insert Arduino pin definition.
 
 	if 'direct' in d['Func']:							# Insert a bunch of inline functions to directly access the pin.
-		direct.append((d['Sig'], d['Description'], d['io_port'], d['io_bit']))
+		if 'io_port' not in d:
+			codegen.error(f"direct pin {d['Sig']} has no port matching `{parser.processor['port_regex']}'.")
+		direct.append((d['Sig'], d['Description'], d['io_port'], d['io_bit'], d['Func']))
 
 # Write output file...
 cg.add_include_guard()
@@ -129,23 +201,96 @@ if parser.metadata['symbol']:
 		cg.add(f"#define GPIO_{sym} {val} // {comment}")
 	cg.add_nl()
 
+proc = parser.processor
+regs = proc['registers']
+mask_type = f"uint{proc['width']}_t"
+def reg(name, port_name):
+	"Return the name of a register for a port."
+	return regs[name].format(port=port_name)
+def shifted(mask, shift_key):
+	"Return mask shifted by the value in the processor description, if any."
+	return f"((uint32_t){mask} << {proc[shift_key]})" if proc.get(shift_key) else mask
+def set_bits(port_name, mask):
+	"Return a statement to set bits in the output register, atomically if possible."
+	if 'set' in regs:
+		return f"{reg('set', port_name)} = {shifted(mask, 'set_shift')};"
+	return f"{reg('out', port_name)} |= {mask};"
+def clear_bits(port_name, mask):
+	"Return a statement to clear bits in the output register, atomically if possible."
+	if 'clear' in regs:
+		return f"{reg('clear', port_name)} = {shifted(mask, 'clear_shift')};"
+	return f"{reg('out', port_name)} &= ~{mask};"
+def toggle_bits(port_name, mask):
+	"Return a statement to toggle bits in the output register, atomically if possible."
+	if 'toggle' in regs:
+		return f"{reg('toggle', port_name)} = {mask};"
+	return f"{reg('out', port_name)} ^= {mask};"
+
 if direct:
 	cg.add_comment('Direct access ports.', add_nl=-1)
-	for sig, desc, io_port, io_bit in direct:
+	for sig, desc, io_port, io_bit, _ in direct:
 		cg.add_comment(f"{sig}: {desc}", add_nl=-1)
 		sigCC = codegen.ident_camel(sig, leading=True)
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}SetModeOutput", f"DDR{io_port} |= _BV({io_bit});", leader='static inline'))
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}SetModeInput", f"DDR{io_port} &= ~_BV({io_bit});", leader='static inline'))
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}SetMode", f"if (fout) DDR{io_port} |= _BV({io_bit}); else DDR{io_port} &= ~_BV({io_bit});",
-		  leader='static inline', args='bool fout'))
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}Read", f"return PIN{io_port} | _BV({io_bit});", ret='bool', leader='static inline'))
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}Toggle", f"PORT{io_port} ^= _BV({io_bit});", leader='static inline'))
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}Set", f"PORT{io_port} |= _BV({io_bit});", leader='static inline'))
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}Get", f"return PORT{io_port} & _BV({io_bit});", ret='bool', leader='static inline'))
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}Clear", f"PORT{io_port} &= ~_BV({io_bit});", leader='static inline'))
-		cg.add(codegen.mk_short_function(f"gpio{sigCC}Write", f"if (b) PORT{io_port} |= _BV({io_bit}); else PORT{io_port} &= ~_BV({io_bit});",
+		bit = proc['bit_mask'].format(bit=io_bit)
+		if 'dir' in regs:
+			ddr = reg('dir', io_port)
+			cg.add(codegen.mk_short_function(f"gpio{sigCC}SetModeOutput", f"{ddr} |= {bit};", leader='static inline'))
+			cg.add(codegen.mk_short_function(f"gpio{sigCC}SetModeInput", f"{ddr} &= ~{bit};", leader='static inline'))
+			cg.add(codegen.mk_short_function(f"gpio{sigCC}SetMode", f"if (fout) {ddr} |= {bit}; else {ddr} &= ~{bit};",
+			  leader='static inline', args='bool fout'))
+		cg.add(codegen.mk_short_function(f"gpio{sigCC}Read", f"return {reg('in', io_port)} & {bit};", ret='bool', leader='static inline'))
+		cg.add(codegen.mk_short_function(f"gpio{sigCC}Toggle", toggle_bits(io_port, bit), leader='static inline'))
+		cg.add(codegen.mk_short_function(f"gpio{sigCC}Set", set_bits(io_port, bit), leader='static inline'))
+		cg.add(codegen.mk_short_function(f"gpio{sigCC}Get", f"return {reg('out', io_port)} & {bit};", ret='bool', leader='static inline'))
+		cg.add(codegen.mk_short_function(f"gpio{sigCC}Clear", clear_bits(io_port, bit), leader='static inline'))
+		cg.add(codegen.mk_short_function(f"gpio{sigCC}Write", f"if (b) {set_bits(io_port, bit)} else {clear_bits(io_port, bit)}",
 		  leader='static inline', args='bool b'))
 
+# Batched access to the direct pins on each port, so that related pins can be changed with a single write. Direct pins
+#  are outputs unless the function has keyword `input' or `pullup', and are initially set if it has `high' or `pullup'.
+ports = {}		# Map of port to list of direct pins on that port.
+for sig, desc, io_port, io_bit, func in direct:
+	ports.setdefault(io_port, []).append((sig, io_bit, func_keywords(func)))
+hex_width = proc['width'] // 4
+for io_port, port_pins in ports.items():
+	cg.add_comment(f"Port {io_port} direct access pins.", add_nl=-1)
+	port_uc = io_port.upper()
+	cg.add('enum {')
+	cg.indent()
+	for sig, io_bit, _ in port_pins:
+		cg.add(f"GPIO_PORT{port_uc}_MASK_{sig} = {proc['bit_mask'].format(bit=io_bit)},")
+	ddr_init = sum(1 << io_bit for _, io_bit, keywords in port_pins if not keywords & {'input', 'pullup'})
+	port_init = sum(1 << io_bit for _, io_bit, keywords in port_pins if keywords & {'high', 'pullup'})
+	cg.add(f"GPIO_PORT{port_uc}_MASK_DIRECT = 0x{sum(1 << io_bit for _, io_bit, _ in port_pins):0{hex_width}x},")
+	if 'dir' in regs:
+		cg.add(f"GPIO_PORT{port_uc}_DDR_INIT = 0x{ddr_init:0{hex_width}x},")
+	cg.add(f"GPIO_PORT{port_uc}_PORT_INIT = 0x{port_init:0{hex_width}x},")
+	cg.dedent()
+	cg.add('};')
+	portCC = codegen.ident_camel(f'port {io_port}', leading=True)
+	out_reg = reg('out', io_port)
+	if 'set' in regs and 'clear' in regs and regs['set'] == regs['clear']:	# Set & clear in one atomic write.
+		write_mask = f"{reg('set', io_port)} = {shifted('(value & mask)', 'set_shift')} | {shifted('(~value & mask)', 'clear_shift')};"
+	else:
+		write_mask = f"{out_reg} = ({out_reg} & ~mask) | (value & mask);"
+	cg.add(codegen.mk_short_function(f"gpio{portCC}WriteMask", write_mask, args=f'{mask_type} mask, {mask_type} value', leader='static inline'))
+	cg.add(codegen.mk_short_function(f"gpio{portCC}SetMask", set_bits(io_port, 'mask'), args=f'{mask_type} mask', leader='static inline'))
+	cg.add(codegen.mk_short_function(f"gpio{portCC}ClearMask", clear_bits(io_port, 'mask'), args=f'{mask_type} mask', leader='static inline'))
+	cg.add(codegen.mk_short_function(f"gpio{portCC}ToggleMask", toggle_bits(io_port, 'mask'), args=f'{mask_type} mask', leader='static inline'))
+	cg.add(codegen.mk_short_function(f"gpio{portCC}ReadMask", f"return {reg('in', io_port)} & mask;", ret=mask_type,
+	  args=f'{mask_type} mask', leader='static inline'))
+	init = f"{out_reg} = ({out_reg} & ~GPIO_PORT{port_uc}_MASK_DIRECT) | GPIO_PORT{port_uc}_PORT_INIT;"
+	if 'dir' in regs:
+		ddr = reg('dir', io_port)
+		cg.add(codegen.mk_short_function(f"gpio{portCC}SetModeMask", f"{ddr} = ({ddr} & ~mask) | (outputs & mask);",
+		  args=f'{mask_type} mask, {mask_type} outputs', leader='static inline'))
+		init += f" {ddr} = ({ddr} & ~GPIO_PORT{port_uc}_MASK_DIRECT) | GPIO_PORT{port_uc}_DDR_INIT;"
+	cg.add(codegen.mk_short_function(f"gpio{portCC}Init", init, leader='static inline'))
+if ports:
+	cg.add_comment("Initialise all direct access pins, one write to each register for each port.", add_nl=-1)
+	cg.add(codegen.mk_short_function("gpioInitDirect",
+	  ' '.join(f"gpio{codegen.ident_camel(f'port {x}', leading=True)}Init();" for x in ports), leader='static inline'))
+
 if unused:
 	cg.add_comment("List unused pins", add_nl=-1)
 	cg.add(f"#define GPIO_UNUSED_PINS {', '.join(unused)}")
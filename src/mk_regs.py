@@ -2,7 +2,7 @@
 
 "Code generator to update register definitions from a text representation in a header file. "
 
-import re, argparse
+import sys, re, zlib, argparse, hashlib
 import codegen
 
 INFILE_DEFAULT = 'regs_local.h'
@@ -15,6 +15,14 @@ arg_parser = argparse.ArgumentParser(description='Updates register definitions f
 arg_parser.add_argument('infile', default=INFILE_DEFAULT, nargs='?', help='Input file, will be overwritten.')
 arg_parser.add_argument('--formats', default=','.join(FORMATS_DEFAULT.values()), nargs='?',
 	help='Format symbols for unsigned, signed, hex values.')
+arg_parser.add_argument('--force', action='store_true', help='Regenerate even if the definitions are unchanged.')
+arg_parser.add_argument('--packed', action='store_true',
+	help='Pack registers narrower than 16 bits with no fields into shared storage words.')
+arg_parser.add_argument('--sort', choices=('nv', 'freq'), default='nv',
+	help='Register order, `nv\' puts NV registers last, `freq\' also sorts each segment by descending `freq\' option.')
+
+arg_parser.add_argument('--strings', choices=codegen.STRING_MODES, default='array',
+	help='How name & description strings are declared, see codegen.Codegen.add_avr_array_strings().')
 
 codegen.Verbosity.add_argparse_options(arg_parser)
 options = arg_parser.parse_args()
@@ -23,7 +31,7 @@ codegen.Verbosity.parse_options(options)	# Sort out verbosity.
 # Get symbols used to denote printing formats for registers.
 formats = [_.strip() for _ in options.formats.split(',')]
 if len(formats) != len(FORMATS_DEFAULT):
-	sys.exit("Error: expected {len(FORMATS_DEFAULT)} comma separated values for --format...", 2)
+	codegen.error(f"expected {len(FORMATS_DEFAULT)} comma separated values for --formats")
 formats = dict(zip(FORMATS_DEFAULT.keys(), formats))
 
 # Make parser.
@@ -51,6 +59,20 @@ cg = codegen.Codegen(options.infile, options.infile)
 parser = RegionParser()
 parts = cg.begin(parser.read)
 
+# The hash of the definitions, the formats, this script and the codegen module is written into the generated code. If it
+#  is unchanged then the generated code must be too, so we can skip regeneration.
+defs_hash = hashlib.sha256()
+for script_fn in (__file__, codegen.__file__):
+	with open(script_fn, 'rb') as f_script:
+		defs_hash.update(f_script.read())
+defs_hash.update('\n'.join(parts[RegionParser.S_DEFS] + list(formats.values()) +
+  [str(options.packed), options.sort, options.strings]).encode('utf-8'))
+defs_hash = defs_hash.hexdigest()[:16]
+DEFS_HASH_LEADER = '// Definitions hash: '
+if not options.force and DEFS_HASH_LEADER + defs_hash in parts[RegionParser.S_DECLS][:1]:
+	codegen.message(f"output file `{options.infile}' not written as definitions unchanged.\n")
+	sys.exit()
+
 """ Parse definitions:
 RELAYS [fmt=hex] "Relay state, updated at 10/s rate from this register"
 - RUN   [bit=0] "Run relay, full motor current."
@@ -68,12 +90,18 @@ reReg = re.compile(r'''
 
 def error(msg, flineno=None):
 	"Blurt an error message and die."
-	codegen.error(f"line {flineno}: {msg}" if flineno else msg)
+	if flineno:
+		codegen.error(f"line {flineno}: {msg}", file=options.infile, line=flineno)
+	codegen.error(msg, file=options.infile)
+
+REG_WIDTH = 16		# Width of register storage words in bits.
 
 registers = {}
 # defs with ident in col 1 are registers, with a 5-tuple of (fields, default-value, options, short-description, long-description).
-# Options are a default value as an int, optional `nv' and one of (`hex', 'signed', 'unsigned').
-# defs with leading whitepsace are fields, and add a dict of name: 2-tuple of (bits, description). Options are bit `3' or range `5..7'.
+# Options are a default value as an int, optional `nv' and one of (`hex', 'signed', 'unsigned'), `width' in bits, default 16, and
+#  `freq' a relative access frequency used for sorting.
+# defs with leading whitepsace are fields, and add a dict of name: 4-tuple of (bits, mask, description, long description). Options
+#  are bit `3' or range `5..7', and a default value that must fit in the field.
 REG_IDX_FIELDS, REG_IDX_DEFAULT, REG_IDX_OPTIONS, REG_IDX_DESC, REG_IDX_LONG_DESC = range(5)
 FIELD_IDX_BITS, FIELD_IDX_MASK, FIELD_IDX_DESC, FIELD_IDX_LONG_DESC = range(4)
 
@@ -107,7 +135,7 @@ for lineno, lns in llines:
 		if name in registers:
 			error(f"{name}: duplicate register name.", lineno)
 		default_value = 0					# Default value has a default value! # pylint: disable=invalid-name
-		options = {'fmt' :'unsigned'}		# Format to use when printing.
+		reg_options = {'fmt' :'unsigned', 'width': REG_WIDTH, 'freq': 0}		# Format to use when printing, width, access frequency.
 		for opt in r_options:
 			if opt == 'default':
 				try:
@@ -115,32 +143,39 @@ for lineno, lns in llines:
 				except ValueError:
 					error(f"{name}: bad default option value.", lineno)
 			elif opt == 'nv':
-				options[opt] = ''
+				reg_options[opt] = ''
 			elif opt == 'fmt':
 				if r_options[opt] not in formats.keys(): error(f"{name}: bad fmt option value.", lineno)
-				options['fmt'] = r_options[opt]
+				reg_options['fmt'] = r_options[opt]
+			elif opt in ('width', 'freq'):
+				try:
+					reg_options[opt] = int(r_options[opt], 0)
+				except (TypeError, ValueError):
+					error(f"{name}: bad {opt} option value.", lineno)
+				if opt == 'width' and reg_options[opt] not in range(1, REG_WIDTH+1):
+					error(f"{name}: width must be from 1 to {REG_WIDTH}.", lineno)
 			else:
 				error(f"{name}: illegal option `{opt}'.", lineno)
 
-		registers[name] = [{}, default_value, options, r_short_desc, r_long_desc]
+		registers[name] = [{}, default_value, reg_options, r_short_desc, r_long_desc]
+		reg_name = name				# Fields are added to the last register defined. # pylint: disable=invalid-name
 		existing_field_mask = 0		# Used to check fields do not overlap existing fields. # pylint: disable=invalid-name
 
 	else:
 		# Field declaration...
 		if not registers:
 			error(f"Field {name} has no register.", lineno)
-		reg_name = list(registers)[-1]	# Register is last one defined. # pylint: disable=invalid-name
 		if name in registers[reg_name][REG_IDX_FIELDS]: error(f"{reg_name}: duplicate field `{name}'.", lineno)
 
+		reg_width = registers[reg_name][REG_IDX_OPTIONS]['width']
+		default_value = 0	# pylint: disable=invalid-name
+		bits = None
 		for opt in r_options:
 			opt_txt = f"{opt}={r_options[opt]}"
-			default_value = 0	# pylint: disable=invalid-name
 			if opt == 'default':
 				try:
 					default_value = int(r_options[opt], 0)
-				except ValueError:
-					default_value = None	# pylint: disable=invalid-name
-				if default_value not in (0, 1):
+				except (TypeError, ValueError):
 					error(f"{name}: bad default option value {opt_txt}.", lineno)
 			elif opt == 'bit':
 				try:
@@ -151,25 +186,63 @@ for lineno, lns in llines:
 					bits = bits*2		# Normalise bit spec to (start, end) inclusive.
 				if bits[0] > bits[1]:
 					error(f"{reg_name}: field {name} bad value range `{opt_txt}'.", lineno)
-				if bits[0] not in range(16):
+				if bits[0] not in range(reg_width) or bits[1] not in range(reg_width):
 					error(f"{reg_name}: field {name} bad value `{opt_txt}'.", lineno)
-				field_mask = 0		# pylint: disable=invalid-name
-				for i in range(bits[0], bits[1]+1):
-					field_mask |= 1<<i
+				field_mask = ((1 << (bits[1] - bits[0] + 1)) - 1) << bits[0]	# pylint: disable=invalid-name
 				if field_mask & existing_field_mask:
 					error(f"{reg_name}: field {name} value overlap `{opt_txt}'.", lineno)
 				existing_field_mask |= field_mask
 			else:
 				error(f"{name}: illegal option `{opt_txt}'.", lineno)
 
-		if bits[0] != bits[1]:
-			error(f"{reg_name}: field {name} only single bit fields supported `{opt_txt}'.", lineno)
+		if bits is None:
+			error(f"{reg_name}: field {name} has no bit option.", lineno)
+		if default_value not in range(1 << (bits[1] - bits[0] + 1)):
+			error(f"{reg_name}: field {name} bad default value {default_value} for field width.", lineno)
 		registers[reg_name][REG_IDX_FIELDS][name] = (bits, field_mask, r_short_desc, r_long_desc)
 		registers[reg_name][REG_IDX_DEFAULT] &= ~field_mask
 		registers[reg_name][REG_IDX_DEFAULT] |= default_value << bits[0]	# Add default value to register.
 
-# Sort register names to have those tagged as `nv' last.
-registers = dict(sorted(registers.items(), key=lambda x: 'nv' in x[1][REG_IDX_OPTIONS]))
+# Optionally pack narrow registers with no fields into shared storage words, first fit decreasing by width. NV & volatile
+#  registers are not packed together. Packed registers are removed and a register for each storage word added.
+packed = {}		# Map of packed register name to (storage register name, shift, mask).
+if options.packed:
+	for is_nv in (False, True):
+		candidates = [(r_name, reg) for r_name, reg in registers.items()
+		  if reg[REG_IDX_OPTIONS]['width'] < REG_WIDTH and not reg[REG_IDX_FIELDS] and ('nv' in reg[REG_IDX_OPTIONS]) == is_nv]
+		words = []	# List of [bits used, list of member register names].
+		for r_name, reg in sorted(candidates, key=lambda x: -x[1][REG_IDX_OPTIONS]['width']):
+			width = reg[REG_IDX_OPTIONS]['width']
+			word = next((w for w in words if w[0] + width <= REG_WIDTH), None)
+			if word is None:
+				word = [0, []]
+				words.append(word)
+			word[1].append(r_name)
+			word[0] += width
+		for word in [w for w in words if len(w[1]) > 1]:	# No point packing a single register.
+			word_name = f"PACKED_{'NV_' if is_nv else ''}{'_'.join(word[1])}"
+			word_options = {'fmt': 'hex', 'width': REG_WIDTH, 'freq': 0}
+			if is_nv:
+				word_options['nv'] = ''
+			shift, word_default = 0, 0
+			for r_name in word[1]:
+				reg = registers.pop(r_name)
+				width = reg[REG_IDX_OPTIONS]['width']
+				min_default = -(1 << (width - 1)) if reg[REG_IDX_OPTIONS]['fmt'] == 'signed' else 0
+				if reg[REG_IDX_DEFAULT] not in range(min_default, 1 << width):
+					error(f"{r_name}: default value {reg[REG_IDX_DEFAULT]} does not fit in packed width {width}.")
+				mask = ((1 << width) - 1) << shift
+				packed[r_name] = (word_name, shift, mask)
+				word_default |= (reg[REG_IDX_DEFAULT] << shift) & mask
+				word_options['freq'] = max(word_options['freq'], reg[REG_IDX_OPTIONS]['freq'])
+				shift += width
+			registers[word_name] = [{}, word_default, word_options, f"Packed {', '.join(word[1])}.", '']
+
+# Sort register names to have those tagged as `nv' last, optionally then by descending access frequency.
+if options.sort == 'freq':
+	registers = dict(sorted(registers.items(), key=lambda x: ('nv' in x[1][REG_IDX_OPTIONS], -x[1][REG_IDX_OPTIONS]['freq'])))
+else:
+	registers = dict(sorted(registers.items(), key=lambda x: 'nv' in x[1][REG_IDX_OPTIONS]))
 
 # Get index of start of NV segment. This is probably a oneliner for Python gurus.
 reg_first_nv = len(registers)
@@ -182,6 +255,7 @@ for i, x in enumerate(registers.values()):
 cg.add(parts[RegionParser.S_LEADER])
 cg.add(parts[RegionParser.S_DEFS])
 cg.add(parts[RegionParser.S_SEP])
+cg.add(DEFS_HASH_LEADER + defs_hash)
 
 cg.add_comment('Declare the indices to the registers.', add_nl=-1)
 cg.add('enum {')
@@ -200,10 +274,56 @@ cg.add_comment('Define default values for the NV segment.', add_nl=-1)
 nv_reg_names = list(registers)[reg_first_nv:]
 cg.add(f"#define REGS_NV_DEFAULT_VALS {', '.join([str(registers[r][REG_IDX_DEFAULT]) for r in nv_reg_names])}")
 
+def crc16(data, crc=0xffff):
+	"CRC16 as computed by avr-libc _crc16_update(), polynomial 0xa001."
+	for byte in data:
+		crc ^= byte
+		for _ in range(8):
+			crc = (crc >> 1) ^ 0xa001 if crc & 1 else crc >> 1
+	return crc
+
+# The NV image is the NV registers as little-endian words, so the firmware can check an image against the schema hash
+#  & the defaults CRC without looking at individual registers. The schema covers everything that affects the meaning of
+#  the image, so a change to it means that an existing image must be migrated or set to defaults.
+NV_LAYOUT_VERSION = 1		# Increment if the format of the descriptor itself changes.
+NV_REG_BYTES = REG_WIDTH // 8
+nv_schema = [f"{r}:{REG_WIDTH}:{registers[r][REG_IDX_OPTIONS]['width']}:" +
+  ','.join(f"{fn}={fb[0]}..{fb[1]}" for fn, (fb, *_) in registers[r][REG_IDX_FIELDS].items()) for r in nv_reg_names]
+nv_schema_hash = zlib.crc32(';'.join(nv_schema).encode('utf-8'))
+nv_image = b''.join((registers[r][REG_IDX_DEFAULT] & ((1 << REG_WIDTH) - 1)).to_bytes(NV_REG_BYTES, 'little') for r in nv_reg_names)
+
+# Warn if the layout has changed since the last run, as existing NV images will be invalidated.
+RE_NV_SCHEMA_HASH = re.compile(r'#define\s+REGS_NV_SCHEMA_HASH\s+0x([0-9a-f]+)UL', re.I)
+prev_schema_hash = [int(m.group(1), 16) for m in map(RE_NV_SCHEMA_HASH.match, parts[RegionParser.S_DECLS]) if m]
+if prev_schema_hash and prev_schema_hash[0] != nv_schema_hash:
+	codegen.message(f"Warning: NV layout changed, schema hash 0x{prev_schema_hash[0]:08x} -> 0x{nv_schema_hash:08x}.\n",
+	  codegen.Verbosity.ERROR)
+
+cg.add_comment('NV layout descriptor. The schema hash changes with the names, order, widths or fields of the NV registers.\n'
+  'The CRC is over the default NV image of little-endian words, computed as avr-libc _crc16_update() from 0xffff.', add_nl=-1)
+cg.add(f'#define REGS_NV_LAYOUT_VERSION {NV_LAYOUT_VERSION}')
+cg.add(f'#define REGS_NV_SCHEMA_HASH 0x{nv_schema_hash:08x}UL')
+cg.add(f'#define REGS_NV_DEFAULT_CRC 0x{crc16(nv_image):04x}')
+cg.add('enum {')
+cg.indent()
+for nv_idx, r_name in enumerate(nv_reg_names):
+	cg.add(f'REGS_NV_OFFSET_{r_name} = {nv_idx * NV_REG_BYTES},')
+cg.add(f'REGS_NV_SIZE = {len(nv_image)}')
+cg.dedent()
+cg.add('};')
+
 cg.add_comment('Define how to format the reg when printing.', add_nl=-1)
 p_format = [formats[r[REG_IDX_OPTIONS]['fmt']] for r in registers.values()]
 cg.add(f"#define REGS_FORMAT_DEF {', '.join(p_format)}")
 
+def add_accessors(ident, idx, val_shift, val_mask):
+	"Add inline get & set functions for a value at a shift & mask in a register."
+	ident_cc = codegen.ident_camel(ident, leading=True)
+	cg.add(codegen.mk_short_function(f"regsGet{ident_cc}", f"return (REGS[{idx}] & {val_mask}) >> {val_shift};",
+	  ret='uint16_t', leader='static inline'))
+	cg.add(codegen.mk_short_function(f"regsSet{ident_cc}",
+	  f"REGS[{idx}] = (REGS[{idx}] & ~{val_mask}) | ((v << {val_shift}) & {val_mask});", args='uint16_t v', leader='static inline'))
+
 for f in registers.items():
 	fields = f[1][REG_IDX_FIELDS]
 	reg_name = f[0]
@@ -214,14 +334,34 @@ for f in registers.items():
 		for field_name in fields:
 			bits, field_mask, r_short_desc, r_long_desc = fields[field_name]
 			cg.add(f"\tREGS_{reg_name}_MASK_{field_name} = (int)0x{field_mask:x},")
+			if bits[0] != bits[1]:		# Multibit fields get a shift as well.
+				cg.add(f"\tREGS_{reg_name}_SHIFT_{field_name} = {bits[0]},")
 		cg.dedent()
 		cg.add("};")
 
+		# Accessors for multibit fields.
+		for field_name in [x for x in fields if fields[x][FIELD_IDX_BITS][0] != fields[x][FIELD_IDX_BITS][1]]:
+			add_accessors(f"{reg_name} {field_name}", f"REGS_IDX_{reg_name}",
+			  f"REGS_{reg_name}_SHIFT_{field_name}", f"REGS_{reg_name}_MASK_{field_name}")
+
+if packed:
+	cg.add_comment("Packed registers share a storage register.", add_nl=-1)
+	cg.add("enum {")
+	cg.indent()
+	for r_name, (word_name, shift, mask) in packed.items():
+		cg.add(f"REGS_{r_name}_WORD = REGS_IDX_{word_name},")
+		cg.add(f"REGS_{r_name}_SHIFT = {shift},")
+		cg.add(f"REGS_{r_name}_MASK = (int)0x{mask:x},")
+	cg.dedent()
+	cg.add("};")
+	for r_name in packed:
+		add_accessors(r_name, f"REGS_{r_name}_WORD", f"REGS_{r_name}_SHIFT", f"REGS_{r_name}_MASK")
+
 cg.add_comment("Declare an array of names for each register.", add_nl=-1)
-cg.add_avr_array_strings('REGS_NAMES', registers.keys())
+cg.add_avr_array_strings('REGS_NAMES', registers.keys(), mode=options.strings)
 
 cg.add_comment("Declare an array of description text for each register.", add_nl=-1)
-cg.add_avr_array_strings('REGS_DESCRS', [x[REG_IDX_DESC] for x in registers.values()])
+cg.add_avr_array_strings('REGS_DESCRS', [x[REG_IDX_DESC] for x in registers.values()], mode=options.strings)
 
 cg.add_comment("Declare a multiline string description of the fields.", add_nl=-1)
 def add_c_macro(macro_ln):
@@ -236,7 +376,7 @@ for f in registers.items():
 		add_c_macro(f'    "\\n{f[0].title()}:"')	# Register name.
 		for field_def in fields.items():
 			bit_def = field_def[1][FIELD_IDX_BITS]
-			bit_desc = str(bit_def[0]) if bit_def[0] == bit_def[1] else '..'.join(bit_def)	# pylint: disable=invalid-name
+			bit_desc = str(bit_def[0]) if bit_def[0] == bit_def[1] else f'{bit_def[0]}..{bit_def[1]}'	# pylint: disable=invalid-name
 			add_c_macro(f'    "\\n {field_def[0]}: {bit_desc} ({field_def[1][FIELD_IDX_DESC]})"')
 
 cg.add(parts[RegionParser.S_TRAILER], add_nl=-1)
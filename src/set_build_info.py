@@ -5,37 +5,120 @@ Search for lines like these:
 #define CFG_BUILD_NUMBER 2						# Increment number.
 #define CFG_BUILD_TIMESTAMP "20220925T112148"	# Set new datestamp.
 Fail if either not found.
+
+Alternatively with --output, write the build info to a small generated source file and leave the input file alone, so
+that only that file need be recompiled. A header declaring the build info is written alongside it. With a reproducible
+timestamp from SOURCE_DATE_EPOCH or the git commit time the build number is only incremented, and the file rewritten,
+when the timestamp changes. This applies to updating the input file too.
 '''
 
-import re, time, argparse
+import os, re, time, argparse, subprocess
 import codegen
 
 INFILE_DEFAULT = 'project_config.h'
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%S'
 
 # Parse command line arguments.
 arg_parser = argparse.ArgumentParser(description='Updates build number & date in #defined symbols in C header file.')
 arg_parser.add_argument('infile', default=INFILE_DEFAULT, nargs='?', help='Input file, will be overwritten.')
+arg_parser.add_argument('--output', '-o', help='write build info to this source file instead of updating the input file')
+arg_parser.add_argument('--header', help="header declaring the build info for --output, default output with extension `.h'")
+arg_parser.add_argument('--timestamp', choices=('now', 'epoch', 'git'), default='now',
+	help='timestamp source: current local time, SOURCE_DATE_EPOCH or the commit time of git HEAD, the last two in UTC')
 
 codegen.Verbosity.add_argparse_options(arg_parser)
 options = arg_parser.parse_args()
 codegen.Verbosity.parse_options(options)	# Sort out verbosity.
 
-# Read input file.
-cg = codegen.Codegen(options.infile, options.infile)
-text = cg.begin()
-
-# Match & update symbols. Note that symbol must be preceded by a `#define' to be replaced, as the symbol is likely
-#  referenced after definition in the file.
-UPDATES = (
-	(lambda m: time.strftime('CFG_BUILD_TIMESTAMP "%Y%m%dT%H%M%S"'), r'(?<=#define\s)CFG_BUILD_TIMESTAMP\s+.*$'),
-	(lambda m: f"CFG_BUILD_NUMBER {int(m.group(1)) + 1}", r'(?<=#define\s)CFG_BUILD_NUMBER\s*(\d+)'),
-)
-
-for repl, regex in UPDATES:
-	text, n_sub = re.subn(regex, repl, text, flags=re.M)
-	if n_sub != 1:
-		codegen.error(f"expected line like `{regex}'")
-
-# This rewrites and closes the file. Thanks codegen!
-cg.add(text)
-cg.end()
+def git(*args):
+	"Run a git command and return the output, error if it fails."
+	try:
+		return subprocess.run(['git'] + list(args), check=True, capture_output=True, text=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError) as exc:
+		codegen.error(f"git {' '.join(args)} failed: {exc}")
+		return None		# Shut up Pylint.
+
+def get_timestamp():
+	"Return the timestamp string for the build."
+	if options.timestamp == 'now':
+		return time.strftime(TIMESTAMP_FORMAT)
+	if options.timestamp == 'epoch':
+		try:
+			epoch = int(os.environ['SOURCE_DATE_EPOCH'])
+		except (KeyError, ValueError):
+			codegen.error("SOURCE_DATE_EPOCH not set to an integer.")
+	else:
+		epoch = int(git('log', '-1', '--format=%ct'))
+	return time.strftime(TIMESTAMP_FORMAT, time.gmtime(epoch))
+
+def read_previous(filename):
+	"Return the contents of the previous build info file, or an empty string if there is none."
+	try:
+		with open(filename, 'rt', encoding='utf-8') as fin:
+			return fin.read()
+	except EnvironmentError:
+		return ''
+
+def build_increment(config_text):
+	"""Return the increment for the build number in the input file. With a reproducible timestamp the build number is
+		left alone if the timestamp is unchanged, so the file is too."""
+	m_previous = re.search(r'(?<=#define\s)CFG_BUILD_TIMESTAMP\s+"(\w*)"', config_text)
+	return 0 if reproducible and m_previous and m_previous.group(1) == timestamp else 1
+
+timestamp = get_timestamp()
+reproducible = options.timestamp != 'now'		# Build number only changes with the timestamp.
+
+if options.output:
+	previous = read_previous(options.output)
+	m_number = re.search(r'BUILD_INFO_NUMBER\s*=\s*(\d+)', previous)
+	m_timestamp = re.search(r'BUILD_INFO_TIMESTAMP\[\]\s*=\s*"(\w*)"', previous)
+	build_number = int(m_number.group(1)) if m_number else 0
+	if not (m_timestamp and m_timestamp.group(1) == timestamp):
+		build_number += 1
+
+	symbols = [('char', 'BUILD_INFO_TIMESTAMP[]', f'"{timestamp}"'), ('uint16_t', 'BUILD_INFO_NUMBER', build_number)]
+	if options.timestamp == 'git':
+		symbols.append(('char', 'BUILD_INFO_COMMIT[]', f'''"{git('rev-parse', '--short', 'HEAD')}"'''))
+	header = options.header or os.path.splitext(options.output)[0] + '.h'
+	if os.path.abspath(header) == os.path.abspath(options.output):
+		codegen.error(f"header `{header}' is the same file as the output.")
+
+	cg = codegen.Codegen(options.output, header)
+	codegen.message(f"{cg.script}: ")
+	cg.add_include_guard()
+	cg.add_comment(f"This file is autogenerated by `{cg.script}'. Do not edit, your changes will be lost!", add_nl=+1)
+	cg.add('#include <stdint.h>', add_nl=+1)
+	for c_type, name, _ in symbols:
+		cg.add(f"extern const {c_type} {name};")
+	cg.end()
+
+	cg = codegen.Codegen(options.output, options.output)
+	codegen.message(f"{cg.script}: ")
+	cg.add_comment(f"This file is autogenerated by `{cg.script}'. Do not edit, your changes will be lost!", add_nl=+1)
+	cg.add(f'#include "{os.path.basename(header)}"', add_nl=+1)		# Declares with external linkage for C++.
+	for c_type, name, value in symbols:
+		cg.add(f"const {c_type} {name} = {value};")
+	cg.end()
+
+else:
+	# Read input file. Never cached as the output depends on the time & build number as well as the input.
+	cg = codegen.Codegen(options.infile, options.infile, cache=False)
+	text = cg.begin()
+
+	increment = build_increment(text)
+
+	# Match & update symbols. Note that symbol must be preceded by a `#define' to be replaced, as the symbol is likely
+	#  referenced after definition in the file.
+	UPDATES = (
+		(lambda m: f'CFG_BUILD_TIMESTAMP "{timestamp}"', r'(?<=#define\s)CFG_BUILD_TIMESTAMP\s+.*$'),
+		(lambda m: f"CFG_BUILD_NUMBER {int(m.group(1)) + increment}", r'(?<=#define\s)CFG_BUILD_NUMBER\s*(\d+)'),
+	)
+
+	for repl, regex in UPDATES:
+		text, n_sub = re.subn(regex, repl, text, flags=re.M)
+		if n_sub != 1:
+			codegen.error(f"expected line like `{regex}'")
+
+	# This rewrites and closes the file. Thanks codegen!
+	cg.add(text)
+	cg.end()
@@ -1,7 +1,7 @@
 #ifndef F_GPIO_H__
 #define F_GPIO_H__
 
-// This file is autogenerated from `../tst/gpio.csv'. Do not edit, your changes will be lost!
+// This file is autogenerated from `gpio.csv'. Do not edit, your changes will be lost!
 
 // Pin Assignments for processor Arduino Mega 328P [avr8], project: Ropemaker Controller.
 enum {
@@ -17,6 +17,7 @@ enum {
     GPIO_PIN_REM2_DIR = 7,                         // Wireless remote FWD/REV active low.
     GPIO_PIN_SW_RUN = A2,                          // RUN/STOP button active low.
     GPIO_PIN_SW_DIR = A3,                          // FWD/REV button active low.
+    GPIO_PIN_SW_AUX = A5,                          // Auxiliary button active low.
 
     // Output
     GPIO_PIN_RLY_RUN = 3,                          // Run relay active high.
@@ -43,7 +44,7 @@ enum {
 static inline void gpioRlyRunSetModeOutput() { DDRD |= _BV(3); }
 static inline void gpioRlyRunSetModeInput() { DDRD &= ~_BV(3); }
 static inline void gpioRlyRunSetMode(bool fout) { if (fout) DDRD |= _BV(3); else DDRD &= ~_BV(3); }
-static inline bool gpioRlyRunRead() { return PIND | _BV(3); }
+static inline bool gpioRlyRunRead() { return PIND & _BV(3); }
 static inline void gpioRlyRunToggle() { PORTD ^= _BV(3); }
 static inline void gpioRlyRunSet() { PORTD |= _BV(3); }
 static inline bool gpioRlyRunGet() { return PORTD & _BV(3); }
@@ -54,7 +55,7 @@ static inline void gpioRlyRunWrite(bool b) { if (b) PORTD |= _BV(3); else PORTD
 static inline void gpioRlyDir2SetModeOutput() { DDRB |= _BV(0); }
 static inline void gpioRlyDir2SetModeInput() { DDRB &= ~_BV(0); }
 static inline void gpioRlyDir2SetMode(bool fout) { if (fout) DDRB |= _BV(0); else DDRB &= ~_BV(0); }
-static inline bool gpioRlyDir2Read() { return PINB | _BV(0); }
+static inline bool gpioRlyDir2Read() { return PINB & _BV(0); }
 static inline void gpioRlyDir2Toggle() { PORTB ^= _BV(0); }
 static inline void gpioRlyDir2Set() { PORTB |= _BV(0); }
 static inline bool gpioRlyDir2Get() { return PORTB & _BV(0); }
@@ -65,7 +66,7 @@ static inline void gpioRlyDir2Write(bool b) { if (b) PORTB |= _BV(0); else PORTB
 static inline void gpioRlyStartSetModeOutput() { DDRB |= _BV(1); }
 static inline void gpioRlyStartSetModeInput() { DDRB &= ~_BV(1); }
 static inline void gpioRlyStartSetMode(bool fout) { if (fout) DDRB |= _BV(1); else DDRB &= ~_BV(1); }
-static inline bool gpioRlyStartRead() { return PINB | _BV(1); }
+static inline bool gpioRlyStartRead() { return PINB & _BV(1); }
 static inline void gpioRlyStartToggle() { PORTB ^= _BV(1); }
 static inline void gpioRlyStartSet() { PORTB |= _BV(1); }
 static inline bool gpioRlyStartGet() { return PORTB & _BV(1); }
@@ -76,7 +77,7 @@ static inline void gpioRlyStartWrite(bool b) { if (b) PORTB |= _BV(1); else PORT
 static inline void gpioHeartbeatLedSetModeOutput() { DDRB |= _BV(5); }
 static inline void gpioHeartbeatLedSetModeInput() { DDRB &= ~_BV(5); }
 static inline void gpioHeartbeatLedSetMode(bool fout) { if (fout) DDRB |= _BV(5); else DDRB &= ~_BV(5); }
-static inline bool gpioHeartbeatLedRead() { return PINB | _BV(5); }
+static inline bool gpioHeartbeatLedRead() { return PINB & _BV(5); }
 static inline void gpioHeartbeatLedToggle() { PORTB ^= _BV(5); }
 static inline void gpioHeartbeatLedSet() { PORTB |= _BV(5); }
 static inline bool gpioHeartbeatLedGet() { return PORTB & _BV(5); }
@@ -87,7 +88,7 @@ static inline void gpioHeartbeatLedWrite(bool b) { if (b) PORTB |= _BV(5); else
 static inline void gpioRlyDir1SetModeOutput() { DDRC |= _BV(1); }
 static inline void gpioRlyDir1SetModeInput() { DDRC &= ~_BV(1); }
 static inline void gpioRlyDir1SetMode(bool fout) { if (fout) DDRC |= _BV(1); else DDRC &= ~_BV(1); }
-static inline bool gpioRlyDir1Read() { return PINC | _BV(1); }
+static inline bool gpioRlyDir1Read() { return PINC & _BV(1); }
 static inline void gpioRlyDir1Toggle() { PORTC ^= _BV(1); }
 static inline void gpioRlyDir1Set() { PORTC |= _BV(1); }
 static inline bool gpioRlyDir1Get() { return PORTC & _BV(1); }
@@ -98,11 +99,74 @@ static inline void gpioRlyDir1Write(bool b) { if (b) PORTC |= _BV(1); else PORTC
 static inline void gpioDebug0SetModeOutput() { DDRC |= _BV(4); }
 static inline void gpioDebug0SetModeInput() { DDRC &= ~_BV(4); }
 static inline void gpioDebug0SetMode(bool fout) { if (fout) DDRC |= _BV(4); else DDRC &= ~_BV(4); }
-static inline bool gpioDebug0Read() { return PINC | _BV(4); }
+static inline bool gpioDebug0Read() { return PINC & _BV(4); }
 static inline void gpioDebug0Toggle() { PORTC ^= _BV(4); }
 static inline void gpioDebug0Set() { PORTC |= _BV(4); }
 static inline bool gpioDebug0Get() { return PORTC & _BV(4); }
 static inline void gpioDebug0Clear() { PORTC &= ~_BV(4); }
 static inline void gpioDebug0Write(bool b) { if (b) PORTC |= _BV(4); else PORTC &= ~_BV(4); }
 
+// SW_AUX: Auxiliary button active low.
+static inline void gpioSwAuxSetModeOutput() { DDRC |= _BV(5); }
+static inline void gpioSwAuxSetModeInput() { DDRC &= ~_BV(5); }
+static inline void gpioSwAuxSetMode(bool fout) { if (fout) DDRC |= _BV(5); else DDRC &= ~_BV(5); }
+static inline bool gpioSwAuxRead() { return PINC & _BV(5); }
+static inline void gpioSwAuxToggle() { PORTC ^= _BV(5); }
+static inline void gpioSwAuxSet() { PORTC |= _BV(5); }
+static inline bool gpioSwAuxGet() { return PORTC & _BV(5); }
+static inline void gpioSwAuxClear() { PORTC &= ~_BV(5); }
+static inline void gpioSwAuxWrite(bool b) { if (b) PORTC |= _BV(5); else PORTC &= ~_BV(5); }
+
+// Port D direct access pins.
+enum {
+    GPIO_PORTD_MASK_RLY_RUN = _BV(3),
+    GPIO_PORTD_MASK_DIRECT = 0x08,
+    GPIO_PORTD_DDR_INIT = 0x08,
+    GPIO_PORTD_PORT_INIT = 0x00,
+};
+static inline void gpioPortDWriteMask(uint8_t mask, uint8_t value) { PORTD = (PORTD & ~mask) | (value & mask); }
+static inline void gpioPortDSetMask(uint8_t mask) { PORTD |= mask; }
+static inline void gpioPortDClearMask(uint8_t mask) { PORTD &= ~mask; }
+static inline void gpioPortDToggleMask(uint8_t mask) { PORTD ^= mask; }
+static inline uint8_t gpioPortDReadMask(uint8_t mask) { return PIND & mask; }
+static inline void gpioPortDSetModeMask(uint8_t mask, uint8_t outputs) { DDRD = (DDRD & ~mask) | (outputs & mask); }
+static inline void gpioPortDInit() { PORTD = (PORTD & ~GPIO_PORTD_MASK_DIRECT) | GPIO_PORTD_PORT_INIT; DDRD = (DDRD & ~GPIO_PORTD_MASK_DIRECT) | GPIO_PORTD_DDR_INIT; }
+
+// Port B direct access pins.
+enum {
+    GPIO_PORTB_MASK_RLY_DIR2 = _BV(0),
+    GPIO_PORTB_MASK_RLY_START = _BV(1),
+    GPIO_PORTB_MASK_HEARTBEAT_LED = _BV(5),
+    GPIO_PORTB_MASK_DIRECT = 0x23,
+    GPIO_PORTB_DDR_INIT = 0x23,
+    GPIO_PORTB_PORT_INIT = 0x00,
+};
+static inline void gpioPortBWriteMask(uint8_t mask, uint8_t value) { PORTB = (PORTB & ~mask) | (value & mask); }
+static inline void gpioPortBSetMask(uint8_t mask) { PORTB |= mask; }
+static inline void gpioPortBClearMask(uint8_t mask) { PORTB &= ~mask; }
+static inline void gpioPortBToggleMask(uint8_t mask) { PORTB ^= mask; }
+static inline uint8_t gpioPortBReadMask(uint8_t mask) { return PINB & mask; }
+static inline void gpioPortBSetModeMask(uint8_t mask, uint8_t outputs) { DDRB = (DDRB & ~mask) | (outputs & mask); }
+static inline void gpioPortBInit() { PORTB = (PORTB & ~GPIO_PORTB_MASK_DIRECT) | GPIO_PORTB_PORT_INIT; DDRB = (DDRB & ~GPIO_PORTB_MASK_DIRECT) | GPIO_PORTB_DDR_INIT; }
+
+// Port C direct access pins.
+enum {
+    GPIO_PORTC_MASK_RLY_DIR1 = _BV(1),
+    GPIO_PORTC_MASK_DEBUG_0 = _BV(4),
+    GPIO_PORTC_MASK_SW_AUX = _BV(5),
+    GPIO_PORTC_MASK_DIRECT = 0x32,
+    GPIO_PORTC_DDR_INIT = 0x12,
+    GPIO_PORTC_PORT_INIT = 0x20,
+};
+static inline void gpioPortCWriteMask(uint8_t mask, uint8_t value) { PORTC = (PORTC & ~mask) | (value & mask); }
+static inline void gpioPortCSetMask(uint8_t mask) { PORTC |= mask; }
+static inline void gpioPortCClearMask(uint8_t mask) { PORTC &= ~mask; }
+static inline void gpioPortCToggleMask(uint8_t mask) { PORTC ^= mask; }
+static inline uint8_t gpioPortCReadMask(uint8_t mask) { return PINC & mask; }
+static inline void gpioPortCSetModeMask(uint8_t mask, uint8_t outputs) { DDRC = (DDRC & ~mask) | (outputs & mask); }
+static inline void gpioPortCInit() { PORTC = (PORTC & ~GPIO_PORTC_MASK_DIRECT) | GPIO_PORTC_PORT_INIT; DDRC = (DDRC & ~GPIO_PORTC_MASK_DIRECT) | GPIO_PORTC_DDR_INIT; }
+
+// Initialise all direct access pins, one write to each register for each port.
+static inline void gpioInitDirect() { gpioPortDInit(); gpioPortBInit(); gpioPortCInit(); }
+
 #endif   // F_GPIO_H__
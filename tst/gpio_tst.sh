@@ -0,0 +1,8 @@
+#!/usr/bin/bash
+
+# Generate the GPIO header from the test pin map and check it against the committed output.
+set -e
+W=$(mktemp -d)
+python3 ../src/gpio_mk.py -q gpio.csv -o $W/gpio.h
+diff -s $W/gpio.h gpio.h
+rm -r $W
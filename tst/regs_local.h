@@ -44,6 +44,7 @@ ENABLES [nv fmt=hex] "Non-volatile enable flags.
 - TRACE_FORMAT_BINARY [bit=13] "Dump trace in binary format."
 - TRACE_FORMAT_CONCISE [bit=14] "Dump trace in concise text format."
 >>>  Definition end, declaration start... */
+// Definitions hash: c889f19014f3061c
 
 // Declare the indices to the registers.
 enum {
@@ -64,6 +65,18 @@ enum {
 // Define default values for the NV segment.
 #define REGS_NV_DEFAULT_VALS 1000, 500, 0
 
+// NV layout descriptor. The schema hash changes with the names, order, widths or fields of the NV registers.
+// The CRC is over the default NV image of little-endian words, computed as avr-libc _crc16_update() from 0xffff.
+#define REGS_NV_LAYOUT_VERSION 1
+#define REGS_NV_SCHEMA_HASH 0x5dcaef0cUL
+#define REGS_NV_DEFAULT_CRC 0xc330
+enum {
+    REGS_NV_OFFSET_MOTOR_RUN_DOWN_DURATION = 0,
+    REGS_NV_OFFSET_MOTOR_SOFT_START_DURATION = 2,
+    REGS_NV_OFFSET_ENABLES = 4,
+    REGS_NV_SIZE = 6
+};
+
 // Define how to format the reg when printing.
 #define REGS_FORMAT_DEF CFMT_X, CFMT_X, CFMT_U, CFMT_U, CFMT_X, CFMT_U, CFMT_U, CFMT_X
 
@@ -0,0 +1,22 @@
+#!/usr/bin/bash
+
+# Generate the Python simulator for a test machine, replay a sequence of events & check the trace against a golden file.
+set -e
+../smk/smk.py -f python -D "RESET_EVENT_NAME=EV_RESET" -o sm_sim.autogen.py sm_sim.xml
+
+# Events are `name' or `name:ready', the guard is_ready(ev) is true for the latter.
+python3 - > sm_sim.trace <<'EOP'
+import importlib.util
+spec = importlib.util.spec_from_file_location('sm_sim', 'sm_sim.autogen.py')
+sim = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sim)
+
+m = sim.Machine(guard=lambda guard, ev, state: ev.endswith(':ready'), event_id=lambda ev: ev.split(':')[0],
+  action=lambda action, ev, state: print(f'  {state}: {action}'))
+for ev in 'EV_RESET EV_POKE EV_GO EV_GO EV_GO EV_GO:ready EV_GO EV_STOP EV_STOP'.split():
+	print(f'{ev} -> {m.process(ev)}')
+print('trace:', m.trace)
+print('guard_counts:', m.guard_counts)
+EOP
+
+diff -s sm_sim.trace sm_sim.trace.golden